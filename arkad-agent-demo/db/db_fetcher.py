@@ -5,10 +5,15 @@ import logging
 from typing import List, Dict, Optional
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from fred.fred_processor import fetch_and_insert_macro_metrics_data
 from stocks.candles.candles_processor import fetch_and_insert_stocks_data
 from stocks.sec_forms.xbrl_processor import fetch_and_insert_revenues_data
+from stocks.sec_forms.filing_state import filing_state_table
+from symbol_metadata import symbol_metadata_table
+from market_data_cache import MarketDataCache
+from rate_limiter import RATE_LIMITER
+from async_fetcher import prefetch_revenues_and_macro_metrics
 
 from pathlib import Path
 import traceback
@@ -39,8 +44,40 @@ def initialize_database(engine: sqlalchemy.engine.Engine, db_type: str):
         logging.error(f"An error occurred while initializing the database: {e}")
 
 
-def connect_to_database(db_connection_string: str) -> sqlalchemy.engine.Engine:
-    return create_engine(db_connection_string)
+# Tables only ingestion reads, not market data
+BOOKKEEPING_TABLES = [symbol_metadata_table.name, filing_state_table.name]
+
+
+def existing_bookkeeping_tables(engine: sqlalchemy.engine.Engine) -> List[str]:
+    table_names = set(sqlalchemy.inspect(engine).get_table_names())
+    return [table for table in BOOKKEEPING_TABLES if table in table_names]
+
+
+SQLITE_FAST_WRITE_PRAGMAS = [
+    # WAL lets the agent keep reading while ingestion writes
+    "PRAGMA journal_mode=WAL",
+    # Safe with WAL, syncs on checkpoints instead of on every commit
+    "PRAGMA synchronous=NORMAL",
+    # 64 MB page cache, negative values are in KiB
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+]
+
+
+def set_sqlite_fast_write_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_FAST_WRITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def connect_to_database(
+    db_connection_string: str, sqlite_fast_write: bool = False
+) -> sqlalchemy.engine.Engine:
+    engine = create_engine(db_connection_string)
+    if sqlite_fast_write and engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_fast_write_pragmas)
+    return engine
 
 
 def read_assets_from_json(file_path: str) -> json:
@@ -57,17 +94,39 @@ def run_fetch_job(
     facts_data_path: Optional[str] = None,
     start_date: Optional[str] = "2020-01-01",
     end_date: Optional[str] = datetime.now().strftime('%Y-%m-%d'),
+    max_workers: Optional[int] = None,
+    sqlite_fast_write: bool = False,
+    market_data_cache_path: Optional[str] = None,
+    replay: bool = False,
+    async_mode: bool = False,
+    companyfacts_zip_path: Optional[str] = None,
+    batch_revenues: bool = False,
+    skip_unchanged_filers: bool = False,
+    parallel_transform: bool = False,
+    earnings_format: str = "csv",
 ):
     session = None
+    # The limiter lives as long as the process, budget and stats are per run
+    RATE_LIMITER.reset()
     try:
-        engine = connect_to_database(db_connection_string)
+        if replay and not market_data_cache_path:
+            raise ValueError("Replay mode needs market_data_cache_path to read from.")
+        cache = (
+            MarketDataCache(market_data_cache_path, replay=replay)
+            if market_data_cache_path
+            else None
+        )
+        engine = connect_to_database(db_connection_string, sqlite_fast_write)
         db_type = "sqlite" if "sqlite" in db_connection_string else "postgres"
         if preinitialize_database:
             logging.info("Initializing database with StockData table...")
             initialize_database(engine, db_type)
 
         Session = sessionmaker(bind=engine)
-        session = Session()
+        # In fast-write mode processors don't commit per symbol, each phase is one transaction
+        session = Session(
+            info={"single_transaction": sqlite_fast_write and engine.dialect.name == "sqlite"}
+        )
         logging.info("Fetching data for analysis...")
 
         if (
@@ -89,16 +148,51 @@ def run_fetch_job(
             )
 
         if preinitialize_database:
-            fetch_and_insert_stocks_data(session, stocks, start_date, end_date)
+            fetch_and_insert_stocks_data(
+                session,
+                stocks,
+                start_date,
+                end_date,
+                max_workers=max_workers,
+                cache=cache,
+            )
+            session.commit()
             logging.info("Data for stocks candles fetched and inserted successfully.")
+            # In async mode SEC and FRED are downloaded concurrently up front,
+            # max_workers then bounds the requests in flight per source.
+            # Company facts read from the bulk archive aren't downloaded at all, and
+            # with skip_unchanged_filers only those of companies that filed since the last run.
+            prefetched = (
+                prefetch_revenues_and_macro_metrics(
+                    session,
+                    [] if companyfacts_zip_path or skip_unchanged_filers else stocks,
+                    macro_metrics,
+                    cache,
+                    max_workers,
+                )
+                if async_mode
+                else {}
+            )
             fetch_and_insert_revenues_data(session, 
                                            stocks, 
                                            earnings_data_path, 
                                            facts_data_path, 
                                            start_year=datetime.strptime(start_date, "%Y-%m-%d").date().year,
-                                           end_year=datetime.strptime(end_date, "%Y-%m-%d").date().year)
+                                           end_year=datetime.strptime(end_date, "%Y-%m-%d").date().year,
+                                           cache=cache,
+                                           prefetched=prefetched.get("sec"),
+                                           max_workers=max_workers,
+                                           companyfacts_zip_path=companyfacts_zip_path,
+                                           batch_insert=batch_revenues,
+                                           skip_unchanged=skip_unchanged_filers,
+                                           parallel_transform=parallel_transform,
+                                           earnings_format=earnings_format)
+            session.commit()
             logging.info("Data for stocks revenues fetched and inserted successfully.")
-            fetch_and_insert_macro_metrics_data(session, macro_metrics)
+            fetch_and_insert_macro_metrics_data(
+                session, macro_metrics, cache=cache, prefetched=prefetched.get("fred")
+            )
+            session.commit()
             logging.info("Data for macro metrics fetched and inserted successfully.")
         else:
             logging.info(
@@ -110,5 +204,6 @@ def run_fetch_job(
         logging.error(f"Database error: {error}")
         traceback.print_exc()
     finally:
+        RATE_LIMITER.log_stats()
         if session:
             session.close()
@@ -1,115 +1,199 @@
 import yfinance as yf
 import pandas as pd
+import requests
 import sqlalchemy
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
 from typing import List, Dict, Optional
-from sqlalchemy import text, insert, select
-from sqlalchemy.dialects.postgresql import insert as insert_postgres
+from bulk_loader import insert_rows, commit_progress
+from market_data_cache import MarketDataCache
+from rate_limiter import create_rate_limited_session
+from symbol_metadata import resolve_industries
+from watermarks import WatermarkSnapshot
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-
-def fetch_stock_data(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
-    stock = yf.Ticker(symbol)
+def fetch_stock_data(
+    symbol: str,
+    start_date: str,
+    end_date: str,
+    requests_session: Optional[requests.Session] = None,
+) -> pd.DataFrame:
+    stock = yf.Ticker(symbol, session=requests_session)
     return stock.history(start=start_date, end=end_date)
 
 
-def calculate_periodic_change(current_value: float, previous_value: float) -> float:
-    return (
-        (current_value - previous_value) / previous_value * 100
-        if previous_value is not None
-        else None
-    )
-
-
-def get_last_date_for_stock(session: sqlalchemy.orm.Session, symbol: str) -> datetime.date:
-    result = session.execute(
-        text("SELECT MAX(Date) FROM StockData WHERE Symbol = :symbol"),
-        {"symbol": symbol},
-    ).fetchone()
-    last_date = None
-    if result:
-        last_date = (
-            datetime.strptime(result[0], "%Y-%m-%d").date()
-            if isinstance(result[0], str)
-            else result[0]
+def calculate_periodic_changes(values: pd.Series, previous_value: Optional[float]) -> pd.Series:
+    # Percent change against the previous row, the first row against the stored value
+    previous_values = values.shift(1)
+    if not values.empty and previous_value is not None:
+        previous_values.iloc[0] = previous_value
+    return (values - previous_values) / previous_values * 100
+
+
+def fetch_stocks_job(
+    symbol: str,
+    start_date: date,
+    end_date: date,
+    cache: Optional[MarketDataCache] = None,
+    requests_session: Optional[requests.Session] = None,
+) -> Optional[pd.DataFrame]:
+    # Network and disk bound only, safe to run off the session's thread
+    start, end = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+    if cache:
+        cached = cache.load("yfinance", symbol, start, end)
+        if cached is not None or cache.replay:
+            return cached
+
+    stock_data = fetch_stock_data(symbol, start, end, requests_session)
+    if cache and not stock_data.empty:
+        cache.store("yfinance", symbol, start, end, stock_data)
+    return stock_data
+
+
+def resolve_missing_sectors(
+    session: sqlalchemy.orm.Session,
+    symbols: List[str],
+    cache: Optional[MarketDataCache] = None,
+    requests_session: Optional[requests.Session] = None,
+) -> Dict[str, str]:
+    if not cache:
+        return resolve_industries(session.bind, symbols, requests_session=requests_session)
+
+    if cache.replay:
+        industries = {}
+        for symbol in symbols:
+            cached = cache.load("yfinance-info", symbol, "", "")
+            if cached is not None and not cached.empty:
+                industries[symbol] = cached["industry"].iloc[0]
+        # Whatever the metadata table already knows, without asking yfinance
+        missing = [symbol for symbol in symbols if symbol not in industries]
+        industries.update(resolve_industries(session.bind, missing, refresh=False))
+        return industries
+
+    industries = resolve_industries(session.bind, symbols, requests_session=requests_session)
+    for symbol, industry in industries.items():
+        cache.store("yfinance-info", symbol, "", "", pd.DataFrame({"industry": [industry]}))
+    return industries
+
+
+def insert_stock_data(
+    session: sqlalchemy.orm.Session,
+    stock_table: sqlalchemy.Table,
+    symbol: str,
+    sector: str,
+    stock_data: pd.DataFrame,
+    prev_close: Optional[float],
+):
+    if stock_data.empty:
+        logging.info(f"No new candles for {symbol}")
+        return
+
+    daily_changes = calculate_periodic_changes(stock_data["Close"], prev_close)
+    if prev_close is None:
+        # Nothing to compare the first candle against, same as a fresh symbol
+        stock_data, daily_changes = stock_data.iloc[1:], daily_changes.iloc[1:]
+
+    data_to_insert = [
+        {
+            "symbol": symbol,
+            "sector": sector,
+            "date": date_str,
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": volume,
+            "dailychangepercent": daily_change,
+        }
+        for date_str, open_, high, low, close, volume, daily_change in zip(
+            stock_data.index.strftime("%Y-%m-%d"),
+            stock_data["Open"].tolist(),
+            stock_data["High"].tolist(),
+            stock_data["Low"].tolist(),
+            stock_data["Close"].tolist(),
+            stock_data["Volume"].tolist(),
+            daily_changes.tolist(),
         )
+    ]
 
-    return last_date
-
+    if not data_to_insert:
+        logging.info(f"No new candles for {symbol}")
+        return
 
-def get_last_close_for_stock(
-    session: sqlalchemy.orm.Session, stock_table: sqlalchemy.Table, symbol: str
-) -> float:
-    last_close_query = (
-        select(stock_table.c.close)
-        .where(stock_table.c.symbol == symbol)
-        .order_by(stock_table.c.date.desc())
-        .limit(1)
-    )
-    result = session.execute(last_close_query).fetchone()
-    return result[0] if result else None
+    insert_rows(session, stock_table, data_to_insert)
+    commit_progress(session)
 
 
 def fetch_and_insert_stocks_data(
     session: sqlalchemy.orm.Session, stocks: List[Dict[str, str]], 
     start_date: Optional[str] = "2023-01-01",
     end_date: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    watermarks: Optional[WatermarkSnapshot] = None,
+    cache: Optional[MarketDataCache] = None,
 ):
+    """Fetch candles for every stock and insert them.
+
+    With max_workers > 1 the per-ticker requests run in a
+    bounded thread pool while all database reads and writes stay on the calling thread,
+    so the inserted rows are the same as in a sequential run.
+    """
     stock_table = sqlalchemy.Table(
         "stockdata", sqlalchemy.MetaData(), autoload_with=session.bind
     )
+    watermarks = watermarks or WatermarkSnapshot.load(session, stock_table, "symbol", "close")
 
+    jobs = []
     for stock in stocks:
         symbol = stock["ticker"]
         sector = stock["sector"]
-        if not sector:
-            sector = yf.Ticker(symbol).get_info().get("industry", "")
-        last_date = get_last_date_for_stock(session, symbol)
+        last_date = watermarks.last_date(symbol)
         start_date_local = (
             (last_date + timedelta(days=1))
             if last_date
             else datetime.strptime(start_date, "%Y-%m-%d").date()
         )
         end_date_local= datetime.now().date() if not end_date else datetime.strptime(end_date, "%Y-%m-%d").date()
-        if start_date < end_date:
-            stock_data = fetch_stock_data(
-                symbol, start_date_local.strftime("%Y-%m-%d"), end_date_local.strftime("%Y-%m-%d")
+        if start_date_local < end_date_local:
+            jobs.append(
+                {
+                    "symbol": symbol,
+                    "sector": sector,
+                    "start": start_date_local,
+                    "end": end_date_local,
+                    "prev_close": watermarks.last_value(symbol),
+                }
             )
 
-            prev_close = get_last_close_for_stock(session, stock_table, symbol)
-            data_to_insert = []
-            for index, row in stock_data.iterrows():
-                daily_change = calculate_periodic_change(row["Close"], prev_close)
-                prev_close = row["Close"]
-                if daily_change is not None:
-                    data_to_insert.append(
-                        {
-                            "symbol": symbol,
-                            "sector": sector,
-                            "date": index.strftime("%Y-%m-%d"),
-                            "open": row["Open"],
-                            "high": row["High"],
-                            "low": row["Low"],
-                            "close": row["Close"],
-                            "volume": row["Volume"],
-                            "dailychangepercent": daily_change,
-                        }
-                    )
-
-            if session.bind.dialect.name == "postgresql":
-                statement = (
-                    insert_postgres(stock_table)
-                    .values(data_to_insert)
-                    .on_conflict_do_nothing()
-                )
-            elif session.bind.dialect.name == "sqlite":
-                statement = (
-                    insert(stock_table).values(data_to_insert).prefix_with("OR IGNORE")
-                )
-
-            session.execute(statement)
-            session.commit()
-            
\ No newline at end of file
+    # One pooled connection per worker, all throttled by the shared per-host limiter
+    requests_session = create_rate_limited_session(pool_maxsize=max(max_workers or 1, 10))
+    industries = resolve_missing_sectors(
+        session, [job["symbol"] for job in jobs if not job["sector"]], cache, requests_session
+    )
+    for job in jobs:
+        job["sector"] = job["sector"] or industries.get(job["symbol"], "")
+
+    logging.info(f"Fetching candles for {len(jobs)} stocks")
+
+    def fetch_job(job):
+        return fetch_stocks_job(job["symbol"], job["start"], job["end"], cache, requests_session)
+
+    def insert_job(job, stock_data):
+        if stock_data is None:
+            logging.warning(f"Skipping {job['symbol']}, its candles weren't fetched")
+            return
+        insert_stock_data(
+            session, stock_table, job["symbol"], job["sector"], stock_data, job["prev_close"]
+        )
+
+    if max_workers and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch_job, job) for job in jobs]
+            for job, future in zip(jobs, futures):
+                insert_job(job, future.result())
+    else:
+        for job in jobs:
+            insert_job(job, fetch_job(job))
@@ -0,0 +1,70 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import quote
+
+# Columns of the stockfinancialdata rows stored in each file, sector and year are the partition keys
+EARNINGS_SCHEMA = pa.schema(
+    [
+        ("symbol", pa.string()),
+        ("reporttype", pa.string()),
+        ("period", pa.string()),
+        ("amount", pa.float64()),
+        ("yoy", pa.float64()),
+        ("qoq", pa.float64()),
+    ]
+)
+EARNINGS_PARTITIONING = ds.partitioning(
+    pa.schema([("sector", pa.string()), ("year", pa.int64())]), flavor="hive"
+)
+# Directory name pyarrow reads back as a null partition value
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+class EarningsDataset:
+    """Estimated earnings of all companies as one zstd compressed Parquet dataset.
+
+    Files are hive partitioned by sector and year, one per partition
+    (sector=.../year=.../part-0.parquet), so a scan filtered on them only opens the
+    matching files, and rows are sorted by symbol so the footers' statistics skip row
+    groups of other companies. A write rewrites every partition it touches, so all of a
+    run's companies are written together.
+    """
+
+    def __init__(self, dataset_dir: str):
+        self.dataset_dir = Path(dataset_dir)
+
+    def partition_path(self, sector: Optional[str], year: int) -> Path:
+        sector_dir = HIVE_NULL_PARTITION if sector is None else quote(sector, safe="")
+        return self.dataset_dir / f"sector={sector_dir}" / f"year={year}" / "part-0.parquet"
+
+    def write(self, df: pd.DataFrame):
+        """Append df's rows, replacing the stored rows of its symbols in the partitions it touches."""
+        for (sector, year), partition_df in df.groupby(["sector", "year"], sort=False, dropna=False):
+            table = pa.Table.from_pandas(
+                partition_df[EARNINGS_SCHEMA.names], schema=EARNINGS_SCHEMA, preserve_index=False
+            )
+            path = self.partition_path(None if pd.isna(sector) else sector, int(year))
+            if path.exists():
+                stored = pq.read_table(path, schema=EARNINGS_SCHEMA)
+                replaced = pc.is_in(stored.column("symbol"), value_set=table.column("symbol").unique())
+                table = pa.concat_tables([stored.filter(pc.invert(replaced)), table])
+            # A stable sort, quarters keep their order within a symbol's report type
+            table = table.sort_by([("symbol", "ascending"), ("reporttype", "ascending")])
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Dot files are skipped by dataset discovery, so readers never see a partial write
+            partial = path.with_name(f".{path.name}.partial")
+            pq.write_table(table, partial, compression="zstd")
+            partial.replace(path)
+
+    def dataset(self) -> ds.Dataset:
+        return ds.dataset(self.dataset_dir, format="parquet", partitioning=EARNINGS_PARTITIONING)
+
+    def read(self, where: Optional[ds.Expression] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Rows matching where, e.g. (ds.field("sector") == "Technology") & (ds.field("year") >= 2020)."""
+        return self.dataset().to_table(filter=where, columns=columns).to_pandas()
@@ -0,0 +1,101 @@
+import logging
+import requests
+import sqlalchemy
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Table, Column, MetaData, Text, Date, DateTime, select
+from sqlalchemy.dialects.postgresql import insert as insert_postgres
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+
+SUBMISSIONS_URL = "https://data.sec.gov/submissions/CIK{}.json"
+# Filings carrying the financial statements company facts are built from
+PERIODIC_FORMS = {"10-K", "10-K/A", "10-Q", "10-Q/A", "10-KT", "10-QT", "20-F", "20-F/A", "40-F", "40-F/A"}
+
+filing_state_table = Table(
+    "secfilingstate",
+    MetaData(),
+    Column("cik", Text, primary_key=True),
+    Column("symbol", Text, primary_key=True),
+    Column("accessionnumber", Text, nullable=False),
+    Column("filingdate", Date, nullable=False),
+    Column("updatedat", DateTime, nullable=False),
+)
+
+
+def get_periodic_filings(
+    requests_session: requests.Session, cik: str, headers: Dict[str, str]
+) -> Optional[List[Dict]]:
+    """Return the company's recent periodic filings, newest first, from its submissions."""
+    try:
+        response = requests_session.get(SUBMISSIONS_URL.format(cik), headers=headers)
+        response.raise_for_status()
+        recent = response.json()["filings"]["recent"]
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logging.error(f"Can't fetch submissions for CIK {cik}: {e}")
+        return None
+
+    filings = [
+        {
+            "accessionnumber": accession_number,
+            "filingdate": date.fromisoformat(filing_date),
+            # Some filings have no period of report, their filing date stands in for it
+            "reportdate": date.fromisoformat(report_date or filing_date),
+            # Only filings with XBRL data show up in company facts
+            "xbrl": bool(is_xbrl),
+        }
+        for accession_number, filing_date, report_date, form, is_xbrl in zip(
+            recent["accessionNumber"],
+            recent["filingDate"],
+            recent["reportDate"],
+            recent["form"],
+            recent.get("isXBRL") or [1] * len(recent["form"]),
+        )
+        if form in PERIODIC_FORMS
+    ]
+    return sorted(filings, key=lambda filing: filing["filingdate"], reverse=True)
+
+
+def load_filing_state(session: sqlalchemy.orm.Session) -> Dict[Tuple[str, str], Dict]:
+    filing_state_table.create(session.connection(), checkfirst=True)
+    return {
+        (row["cik"], row["symbol"]): dict(row)
+        for row in session.execute(select(filing_state_table)).mappings()
+    }
+
+
+def changed_since(filings: List[Dict], state: Optional[Dict]) -> Tuple[bool, Optional[date]]:
+    """Return whether the company filed since state was recorded and the date its new facts start.
+
+    The date is None when every year has to be recomputed: the company was never
+    processed, has no periodic filings or its recorded filing is no longer listed.
+    """
+    if state is None or not filings:
+        return True, None
+
+    accession_numbers = [filing["accessionnumber"] for filing in filings]
+    if state["accessionnumber"] not in accession_numbers:
+        return True, None
+
+    if accession_numbers.index(state["accessionnumber"]) == 0:
+        return False, None
+    return True, state["filingdate"]
+
+
+def record_filing_state(session: sqlalchemy.orm.Session, rows: List[Dict]):
+    """Store the latest processed filing per company, in the caller's transaction."""
+    if not rows:
+        return
+
+    if session.bind.dialect.name == "postgresql":
+        statement = insert_postgres(filing_state_table)
+    elif session.bind.dialect.name == "sqlite":
+        statement = insert_sqlite(filing_state_table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["cik", "symbol"],
+        set_={
+            column: statement.excluded[column]
+            for column in ["accessionnumber", "filingdate", "updatedat"]
+        },
+    )
+    updatedat = datetime.now()
+    session.execute(statement, [{**row, "updatedat": updatedat} for row in rows])
@@ -1,5 +1,6 @@
 from pathlib import Path
 import pandas as pd
+import sqlalchemy
 from langchain_core.pydantic_v1 import Field, BaseModel, root_validator
 from langchain_core.prompts import PromptTemplate
 from langchain.sql_database import SQLDatabase
@@ -19,7 +20,7 @@ from sql_market_agent.agent.tools.prompts.sql_prompts import (
     SQL_SUFFIX,
     QUERY_CHECKER,
 )
-from sql_market_agent.agent.tools.storage.db_fetcher import run_fetch_job
+from sql_market_agent.agent.tools.storage.db_fetcher import existing_bookkeeping_tables, run_fetch_job
 from typing import List, Dict, Optional, Any, Type
 import logging
 import json
@@ -47,8 +48,10 @@ DB_TABLES_DESCRIPTION = {
         "description": "fundamental data about both quarterly and yearly earnings per year ('FY') "
         "and per each quarter ('Q1', 'Q2', 'Q3', 'Q4') in each year.",
         "data_categories_description": "available columns: symbol; sector; year; "
-        "reporttype - currently only 'Revenue'; period - one of 'Q1', 'Q2', 'Q3', 'Q4', 'FY'; "
-        "amount in USD, qoq - percent change relative to previous quarter for quarterly reports; "
+        "reporttype - one of 'Revenue', 'NetIncome', 'OperatingIncome', 'OperatingCashFlow', 'EPS' "
+        "(diluted earnings per share, basic where a company reports no diluted EPS), 'SharesOutstanding'; period - one of 'Q1', 'Q2', 'Q3', 'Q4', 'FY' "
+        "('SharesOutstanding' has quarters only and 'EPS' and 'SharesOutstanding' only the reported periods); "
+        "amount in USD, USD per share for 'EPS' and number of shares for 'SharesOutstanding', qoq - percent change relative to previous quarter for quarterly reports; "
         "yoy - percent change relative to same quarter of previous year for quarterly reports and "
         "percent change relative to previous year for full year reports.",
     },
@@ -291,10 +294,14 @@ def get_database(
         facts_data_path=facts_data_path,
         start_date=start_date,
         end_date=end_date,
+        sqlite_fast_write=True,
     )
 
     logging.info(f"Connecting to db for sql agent...")
-    db = SQLDatabase.from_uri(db_connection_string)
+    # Ingestion's bookkeeping tables (symbol metadata, SEC filing state) stay out of the
+    # schema the agent is prompted with, any other table of the database is kept
+    engine = sqlalchemy.create_engine(db_connection_string)
+    db = SQLDatabase(engine, ignore_tables=existing_bookkeeping_tables(engine))
     logging.info(f"Connected to db for sql agent successfully")
     return db
 
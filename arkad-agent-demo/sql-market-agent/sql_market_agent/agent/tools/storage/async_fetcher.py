@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import sqlalchemy
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from sql_market_agent.agent.tools.storage.fred.fred_processor import (
+    REVISION_LOOKBACK_DAYS,
+    fetch_macro_metric_group,
+    group_macro_metric_jobs,
+    load_macro_metric_watermarks,
+    plan_macro_metric_jobs,
+)
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.xbrl_processor import (
+    create_session,
+    get_revenue_records,
+    plan_revenue_jobs,
+)
+from sql_market_agent.agent.tools.storage.market_data_cache import MarketDataCache
+from sql_market_agent.agent.tools.storage.rate_limiter import create_rate_limited_session
+
+# Requests in flight per source, the rate limiter still caps requests per second
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+async def fetch_bounded(
+    jobs: List[Dict],
+    fetch_fn: Callable[[Dict], Any],
+    max_concurrency: int,
+    executor: Executor,
+) -> List[Any]:
+    # requests and pandas-datareader are blocking, so each fetch runs on the executor
+    semaphore = asyncio.Semaphore(max_concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def fetch(job):
+        async with semaphore:
+            return await loop.run_in_executor(executor, fetch_fn, job)
+
+    return await asyncio.gather(*(fetch(job) for job in jobs))
+
+
+async def fetch_revenues_and_macro_metrics(
+    revenue_jobs: List[Dict],
+    macro_metric_jobs: List[Dict],
+    cache: Optional[MarketDataCache] = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+) -> Dict[str, Dict[str, Any]]:
+    # One pooled session per source, so connections are reused across requests
+    sec_session = create_session(pool_maxsize=max_concurrency)
+    fred_session = create_rate_limited_session(pool_maxsize=max_concurrency)
+
+    macro_metric_groups = group_macro_metric_jobs(macro_metric_jobs)
+
+    with ThreadPoolExecutor(max_workers=2 * max_concurrency) as executor:
+        revenues, macro_metric_results = await asyncio.gather(
+            fetch_bounded(
+                revenue_jobs,
+                lambda job: get_revenue_records(sec_session, job["cik"], job["symbol"], cache),
+                max_concurrency,
+                executor,
+            ),
+            fetch_bounded(
+                macro_metric_groups,
+                lambda group: fetch_macro_metric_group(group, cache, fred_session),
+                max_concurrency,
+                executor,
+            ),
+        )
+
+    return {
+        "sec": {job["symbol"]: records for job, records in zip(revenue_jobs, revenues)},
+        "fred": {
+            symbol: data
+            for group_data in macro_metric_results
+            for symbol, data in group_data.items()
+        },
+    }
+
+
+def prefetch_revenues_and_macro_metrics(
+    session: sqlalchemy.orm.Session,
+    stocks: List[Dict[str, str]],
+    macro_metrics: List[Dict[str, str]],
+    cache: Optional[MarketDataCache] = None,
+    max_concurrency: Optional[int] = None,
+    revision_lookback_days: int = REVISION_LOOKBACK_DAYS,
+) -> Dict[str, Dict[str, Any]]:
+    """Download SEC company facts and FRED series concurrently, ahead of the inserts.
+
+    Returns the results keyed by source ("sec", "fred") and symbol, in the shape the
+    processors' prefetched argument expects. Only the planning touches the database.
+    """
+    revenue_jobs = plan_revenue_jobs(stocks)
+    macro_metric_jobs = plan_macro_metric_jobs(
+        macro_metrics,
+        load_macro_metric_watermarks(session),
+        revision_lookback_days=revision_lookback_days,
+    )
+
+    started = time.monotonic()
+    prefetched = asyncio.run(
+        fetch_revenues_and_macro_metrics(
+            revenue_jobs, macro_metric_jobs, cache, max_concurrency or DEFAULT_MAX_CONCURRENCY
+        )
+    )
+    logging.info(
+        f"Fetched {len(revenue_jobs)} company facts and {len(macro_metric_jobs)} macro series "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return prefetched
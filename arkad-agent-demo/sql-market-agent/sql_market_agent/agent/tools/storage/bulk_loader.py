@@ -0,0 +1,136 @@
+import csv
+import io
+import sqlalchemy
+import logging
+from typing import List, Dict, Optional
+from sqlalchemy import insert, text
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+
+# executemany binds one row at a time, so chunks only bound the batch size
+# and never get near SQLite's limit on variables per statement
+SQLITE_EXECUTEMANY_CHUNK = 5000
+# COPY reads this marker as NULL, so an empty field stays an empty string
+# (e.g. the sector of stocks given as plain tickers)
+COPY_NULL = "\\N"
+
+
+def rows_to_csv(rows: List[Dict], columns: List[str]) -> io.StringIO:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        [COPY_NULL if row[column] is None else row[column] for column in columns]
+        for row in rows
+    )
+    buffer.seek(0)
+    return buffer
+
+
+def copy_rows_postgres(
+    session: sqlalchemy.orm.Session,
+    table: sqlalchemy.Table,
+    rows: List[Dict],
+    update_on: Optional[List[str]] = None,
+):
+    """Stream rows into a staging table with COPY and merge them with one statement.
+
+    Without update_on rows that already exist are skipped, with it rows conflicting
+    on those columns are overwritten.
+    """
+    columns = list(rows[0])
+    column_list = ", ".join(columns)
+    staging = f"{table.name}_staging"
+
+    # A temporary table is unlogged and invisible to the agent's schema inspection
+    session.execute(
+        text(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} AS "
+            f"SELECT {column_list} FROM {table.name} WITH NO DATA"
+        )
+    )
+    session.execute(text(f"TRUNCATE {staging}"))
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            rows_to_csv(rows, columns),
+        )
+    finally:
+        cursor.close()
+
+    if update_on:
+        updated = ", ".join(
+            f"{column} = EXCLUDED.{column}" for column in columns if column not in update_on
+        )
+        on_conflict = f"ON CONFLICT ({', '.join(update_on)}) DO UPDATE SET {updated}"
+    else:
+        on_conflict = "ON CONFLICT DO NOTHING"
+    result = session.execute(
+        text(
+            f"INSERT INTO {table.name} ({column_list}) "
+            f"SELECT {column_list} FROM {staging} {on_conflict}"
+        )
+    )
+    logging.info(f"Merged {result.rowcount} of {len(rows)} rows into {table.name}")
+    session.execute(text(f"TRUNCATE {staging}"))
+
+
+def insert_rows_sqlite(
+    session: sqlalchemy.orm.Session, table: sqlalchemy.Table, rows: List[Dict]
+):
+    statement = insert(table).prefix_with("OR IGNORE")
+    for i in range(0, len(rows), SQLITE_EXECUTEMANY_CHUNK):
+        session.execute(statement, rows[i:i + SQLITE_EXECUTEMANY_CHUNK])
+
+
+def upsert_rows_sqlite(
+    session: sqlalchemy.orm.Session,
+    table: sqlalchemy.Table,
+    rows: List[Dict],
+    update_on: List[str],
+):
+    statement = insert_sqlite(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=update_on,
+        set_={
+            column: statement.excluded[column]
+            for column in rows[0]
+            if column not in update_on
+        },
+    )
+    for i in range(0, len(rows), SQLITE_EXECUTEMANY_CHUNK):
+        session.execute(statement, rows[i:i + SQLITE_EXECUTEMANY_CHUNK])
+
+
+def insert_rows(
+    session: sqlalchemy.orm.Session, table: sqlalchemy.Table, rows: List[Dict]
+):
+    """Insert rows into table, skipping rows that already exist."""
+    if not rows:
+        return
+
+    if session.bind.dialect.name == "postgresql":
+        copy_rows_postgres(session, table, rows)
+    elif session.bind.dialect.name == "sqlite":
+        insert_rows_sqlite(session, table, rows)
+
+
+def commit_progress(session: sqlalchemy.orm.Session):
+    """Commit after a symbol, unless the session runs one transaction per phase."""
+    if not session.info.get("single_transaction"):
+        session.commit()
+
+
+def upsert_rows(
+    session: sqlalchemy.orm.Session,
+    table: sqlalchemy.Table,
+    rows: List[Dict],
+    update_on: List[str],
+):
+    """Insert rows into table, overwriting rows that conflict on the update_on columns."""
+    if not rows:
+        return
+
+    if session.bind.dialect.name == "postgresql":
+        copy_rows_postgres(session, table, rows, update_on)
+    elif session.bind.dialect.name == "sqlite":
+        upsert_rows_sqlite(session, table, rows, update_on)
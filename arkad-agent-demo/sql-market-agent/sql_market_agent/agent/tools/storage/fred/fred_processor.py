@@ -1,17 +1,48 @@
+import io
+import json
+import numpy as np
 import yfinance as yf
 import pandas as pd
 import pandas_datareader as pdr
+import requests
 import sqlalchemy
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict
+from datetime import datetime, date, timedelta
+from pathlib import Path
+from typing import List, Dict, Optional
 from sqlalchemy import text, insert, select
 from sqlalchemy.dialects.postgresql import insert as insert_postgres
+from sql_market_agent.agent.tools.storage.bulk_loader import upsert_rows, commit_progress
+from sql_market_agent.agent.tools.storage.market_data_cache import MarketDataCache
+from sql_market_agent.agent.tools.storage.rate_limiter import create_rate_limited_session
+from sql_market_agent.agent.tools.storage.watermarks import WatermarkSnapshot, parse_date
 
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# pandas-datareader requests a list of series one by one, the graph endpoint
+# takes a comma separated list of ids and answers with one CSV
+FRED_GRAPH_CSV_URL = "https://fred.stlouisfed.org/graph/fredgraph.csv"
+# Keeps the id list well inside URL length limits
+FRED_BATCH_SIZE = 50
+RELEASE_CATALOG_PATH = Path(__file__).parent / "release_catalog.json"
+# Observations are dated at the start of their period
+FREQUENCY_OFFSETS = {
+    "daily": pd.DateOffset(days=1),
+    "weekly": pd.DateOffset(weeks=1),
+    "monthly": pd.DateOffset(months=1),
+    "quarterly": pd.DateOffset(months=3),
+    "annual": pd.DateOffset(years=1),
+}
+# Days before the last stored observation fetched again to pick up revisions
+REVISION_LOOKBACK_DAYS = 90
+# Postgres stores REAL as 4 byte floats, so stored values match fetched ones to ~7 digits
+REVISION_RTOL = 1e-6
+# Changes are recomputed from rounded stored neighbours, in percentage points
+REVISION_CHANGE_ATOL = 1e-4
+MACRO_METRIC_KEY = ["macrometric", "description", "date"]
+
 
 def calculate_periodic_change(current_value: float, previous_value: float) -> float:
     return (
@@ -21,6 +52,14 @@ def calculate_periodic_change(current_value: float, previous_value: float) -> fl
     )
 
 
+def calculate_periodic_changes(values: pd.Series, previous_value: Optional[float]) -> pd.Series:
+    # Percent change against the previous row, the first row against the stored value
+    previous_values = values.shift(1)
+    if not values.empty and previous_value is not None:
+        previous_values.iloc[0] = previous_value
+    return (values - previous_values) / previous_values * 100
+
+
 def get_last_date_for_bond(session: sqlalchemy.orm.Session, bond: str) -> datetime.date:
     result = session.execute(
         text("SELECT MAX(Date) FROM BondData WHERE Bond = :bond"),
@@ -50,38 +89,14 @@ def get_last_yield_for_bond(
     return result[0] if result else None
 
 
-def get_last_date_for_macro_metric(session: sqlalchemy.orm.Session, macro_metric: str) -> datetime.date:
-    result = session.execute(
-        text("SELECT MAX(Date) FROM MacroMetricData WHERE MacroMetric = :macro_metric"),
-        {"macro_metric": macro_metric},
-    ).fetchone()
-    last_date = None
-    if result:
-        last_date = (
-            datetime.strptime(result[0], "%Y-%m-%d").date()
-            if isinstance(result[0], str)
-            else result[0]
-        )
-
-    return last_date
-
-
-def get_last_value_for_macro_metric(
-    session: sqlalchemy.orm.Session, macro_metric_table: sqlalchemy.Table, macro_metric: str
-) -> float:
-    last_macrometricvalue_query = (
-        select(macro_metric_table.c.macrometricvalue)
-        .where(macro_metric_table.c.macrometric == macro_metric)
-        .order_by(macro_metric_table.c.date.desc())
-        .limit(1)
-    )
-    result = session.execute(last_macrometricvalue_query).fetchone()
-    return result[0] if result else None
-
-
-def fetch_fred_data(symbol: str, start: str, end: str) -> pd.DataFrame:
+def fetch_fred_data(
+    symbol: str,
+    start: str,
+    end: str,
+    requests_session: Optional[requests.Session] = None,
+) -> pd.DataFrame:
     try:
-        data = pdr.get_data_fred(symbol, start, end)
+        data = pdr.get_data_fred(symbol, start, end, session=requests_session)
         if data.empty:
             raise ValueError(f"No data returned for {symbol}")
         return data
@@ -90,6 +105,41 @@ def fetch_fred_data(symbol: str, start: str, end: str) -> pd.DataFrame:
         return pd.DataFrame()
 
 
+def fetch_fred_data_batch(
+    symbols: List[str],
+    start: str,
+    end: str,
+    requests_session: Optional[requests.Session] = None,
+) -> Dict[str, pd.DataFrame]:
+    """Fetch several series with one request and split the wide result per series."""
+    if len(symbols) == 1:
+        return {symbols[0]: fetch_fred_data(symbols[0], start, end, requests_session)}
+
+    try:
+        response = (requests_session or requests).get(
+            FRED_GRAPH_CSV_URL,
+            params={"id": ",".join(symbols), "cosd": start, "coed": end},
+        )
+        response.raise_for_status()
+        data = pd.read_csv(
+            io.StringIO(response.text), index_col=0, parse_dates=True, na_values="."
+        ).truncate(start, end)
+    except Exception as e:
+        # One unknown id fails the whole group, so retry the series one by one
+        logging.error(f"Error fetching {len(symbols)} series together: {e}")
+        return {
+            symbol: fetch_fred_data(symbol, start, end, requests_session)
+            for symbol in symbols
+        }
+
+    data.index.name = "DATE"
+    return {
+        symbol: data[[symbol]].dropna()
+        for symbol in symbols
+        if symbol in data.columns
+    }
+
+
 def fetch_cpi_data(session: sqlalchemy.orm.Session) -> pd.DataFrame:
     MacroData = sqlalchemy.Table('macrodata', sqlalchemy.MetaData(), autoload_with=session.bind)
     end_date = datetime.now()
@@ -149,50 +199,250 @@ def fetch_and_insert_bonds_data(session: sqlalchemy.orm.Session, bonds: List[Dic
             session.commit()
 
 
-def fetch_and_insert_macro_metrics_data(session: sqlalchemy.orm.Session, macro_metrics: List[Dict[str, str]]):
-    macro_metric_table = sqlalchemy.Table('macrometricdata', sqlalchemy.MetaData(), autoload_with=session.bind)
+def load_stored_macro_metrics(
+    session: sqlalchemy.orm.Session,
+    macro_metric_table: sqlalchemy.Table,
+    symbols: List[str],
+    start: str,
+) -> Dict[str, pd.DataFrame]:
+    """Stored values and changes from start on, indexed by date string, per symbol."""
+    query = select(
+        macro_metric_table.c.macrometric,
+        macro_metric_table.c.date,
+        macro_metric_table.c.macrometricvalue,
+        macro_metric_table.c.periodicchangepercent,
+    ).where(
+        macro_metric_table.c.macrometric.in_(symbols),
+        macro_metric_table.c.date >= start,
+    )
+    stored = pd.DataFrame(
+        session.execute(query).fetchall(),
+        columns=["macrometric", "date", "macrometricvalue", "periodicchangepercent"],
+    )
+    stored["date"] = [parse_date(value).strftime("%Y-%m-%d") for value in stored["date"]]
+    return {
+        symbol: frame.set_index("date")[["macrometricvalue", "periodicchangepercent"]].astype(float)
+        for symbol, frame in stored.groupby("macrometric")
+    }
+
+
+def upsert_macro_metric_data(
+    session: sqlalchemy.orm.Session,
+    macro_metric_table: sqlalchemy.Table,
+    symbol: str,
+    description: str,
+    macro_metric_data: pd.DataFrame,
+    prev_value: Optional[float],
+    stored: Optional[pd.DataFrame] = None,
+):
+    """Write the fetched window, skipping rows identical to what is already stored.
+
+    Changes are recomputed over the fetched values merged with the stored ones, so a
+    revised observation also rewrites the change of the observation after it.
+    """
+    if macro_metric_data.empty:
+        logging.info(f"No new observations for {symbol}")
+        return
+
+    # Missing observations ('.' in FRED) and the outer join of grouped fetches are NaN
+    values = macro_metric_data[symbol].dropna()
+    values.index = values.index.strftime("%Y-%m-%d")
+    if stored is not None:
+        values = values.combine_first(stored["macrometricvalue"]).sort_index()
+
+    periodic_changes = calculate_periodic_changes(values, prev_value)
+    if prev_value is None:
+        values, periodic_changes = values.iloc[1:], periodic_changes.iloc[1:]
+
+    if stored is not None:
+        stored = stored.reindex(values.index)
+        unchanged = np.isclose(
+            values, stored["macrometricvalue"], rtol=REVISION_RTOL, atol=0, equal_nan=True
+        ) & np.isclose(
+            periodic_changes,
+            stored["periodicchangepercent"],
+            rtol=0,
+            atol=REVISION_CHANGE_ATOL,
+            equal_nan=True,
+        )
+        revised = int((~unchanged & stored["macrometricvalue"].notna()).sum())
+        if revised:
+            logging.info(f"Updating {revised} stored observations of {symbol}")
+        values, periodic_changes = values[~unchanged], periodic_changes[~unchanged]
+
+    data_to_insert = [
+        {
+            "macrometric": symbol,
+            "description": description,
+            "date": date_str,
+            "macrometricvalue": value,
+            "periodicchangepercent": periodic_change,
+        }
+        for date_str, value, periodic_change in zip(
+            values.index,
+            values.tolist(),
+            periodic_changes.tolist(),
+        )
+    ]
+    if not data_to_insert:
+        return
+
+    upsert_rows(session, macro_metric_table, data_to_insert, MACRO_METRIC_KEY)
+    commit_progress(session)
 
+
+def load_release_catalog(file_path: Path = RELEASE_CATALOG_PATH) -> Dict[str, Dict]:
+    try:
+        with open(file_path, "r") as file:
+            return json.load(file)
+    except IOError as e:
+        logging.error(f"Error reading {file_path}: {e}")
+        return {}
+
+
+def next_expected_release(last_date: date, release: Dict) -> date:
+    """Earliest day the observation following last_date can be published.
+
+    release_lag_days is the shortest delay between the end of a period and its release,
+    so a series is never skipped on a day its data could have come out.
+    """
+    period = FREQUENCY_OFFSETS[release["frequency"]]
+    next_period_end = pd.Timestamp(last_date) + period + period - pd.Timedelta(days=1)
+    return (next_period_end + pd.Timedelta(days=release["release_lag_days"])).date()
+
+
+def plan_macro_metric_jobs(
+    macro_metrics: List[Dict[str, str]],
+    watermarks: WatermarkSnapshot,
+    release_catalog: Optional[Dict[str, Dict]] = None,
+    revision_lookback_days: int = REVISION_LOOKBACK_DAYS,
+) -> List[Dict]:
+    """Plan a fetch for every series that can have new observations.
+
+    Series in the release catalog are skipped until their next release is due,
+    series missing from it are fetched on every run. Stored series are fetched from
+    revision_lookback_days before their last observation to pick up revisions.
+    """
+    release_catalog = load_release_catalog() if release_catalog is None else release_catalog
+    jobs = []
     for macro_metric in macro_metrics:
         symbol = macro_metric["symbol"]
-        description = macro_metric["description"]
-        last_date = get_last_date_for_macro_metric(session, symbol)
+        last_date = watermarks.last_date(symbol)
         start_date = (
             (last_date + timedelta(days=1))
             if last_date
             else datetime(2013, 1, 1).date()
         )
         end_date = datetime.now().date()
+        # The new observations' window decides whether there is anything to fetch,
+        # the lookback only widens it
+        fetch_start_date = start_date - timedelta(days=revision_lookback_days) if last_date else start_date
+        if last_date and symbol in release_catalog:
+            release_date = next_expected_release(last_date, release_catalog[symbol])
+            if release_date > end_date:
+                logging.info(f"Skipping {symbol}, next release expected on {release_date}")
+                continue
         if start_date < end_date:
-            macro_metric_data = fetch_fred_data(
-                symbol, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+            jobs.append(
+                {
+                    "symbol": symbol,
+                    "description": macro_metric["description"],
+                    "start": fetch_start_date.strftime("%Y-%m-%d"),
+                    "end": end_date.strftime("%Y-%m-%d"),
+                }
             )
+    return jobs
 
-            prev_value = get_last_value_for_macro_metric(session, macro_metric_table, symbol)
-            data_to_insert = []
-            for index, row in macro_metric_data.iterrows():
-                periodic_change = calculate_periodic_change(row[symbol], prev_value)
-                prev_value = row[symbol]
-                if periodic_change is not None:
-                    data_to_insert.append(
-                        {
-                            "macrometric": symbol,
-                            "description": description,
-                            "date": index.strftime("%Y-%m-%d"),
-                            "macrometricvalue": row[symbol],
-                            "periodicchangepercent": periodic_change,
-                        }
-                    )
 
-            if session.bind.dialect.name == "postgresql":
-                statement = (
-                    insert_postgres(macro_metric_table)
-                    .values(data_to_insert)
-                    .on_conflict_do_nothing()
-                )
-            elif session.bind.dialect.name == "sqlite":
-                statement = (
-                    insert(macro_metric_table).values(data_to_insert).prefix_with("OR IGNORE")
-                )
+def group_macro_metric_jobs(
+    jobs: List[Dict], batch_size: int = FRED_BATCH_SIZE
+) -> List[List[Dict]]:
+    """Group jobs sharing the same fetch window into batches of at most batch_size."""
+    windows = {}
+    for job in jobs:
+        windows.setdefault((job["start"], job["end"]), []).append(job)
 
-            session.execute(statement)
-            session.commit()
+    return [
+        window_jobs[i:i + batch_size]
+        for window_jobs in windows.values()
+        for i in range(0, len(window_jobs), batch_size)
+    ]
+
+
+def fetch_macro_metric_group(
+    jobs: List[Dict],
+    cache: Optional[MarketDataCache] = None,
+    requests_session: Optional[requests.Session] = None,
+) -> Dict[str, pd.DataFrame]:
+    start, end = jobs[0]["start"], jobs[0]["end"]
+    symbols = [job["symbol"] for job in jobs]
+    macro_metrics_data = {}
+    if cache:
+        for symbol in symbols:
+            cached = cache.load("fred", symbol, start, end)
+            if cached is not None:
+                macro_metrics_data[symbol] = cached
+        symbols = [symbol for symbol in symbols if symbol not in macro_metrics_data]
+        if cache.replay:
+            for symbol in symbols:
+                logging.warning(f"Replay mode: no cached fred data for {symbol}, skipping")
+            return macro_metrics_data
+
+    fetched = fetch_fred_data_batch(symbols, start, end, requests_session) if symbols else {}
+    if cache:
+        for symbol, data in fetched.items():
+            if not data.empty:
+                cache.store("fred", symbol, start, end, data)
+    macro_metrics_data.update(fetched)
+    return macro_metrics_data
+
+
+def load_macro_metric_watermarks(session: sqlalchemy.orm.Session) -> WatermarkSnapshot:
+    macro_metric_table = sqlalchemy.Table('macrometricdata', sqlalchemy.MetaData(), autoload_with=session.bind)
+    return WatermarkSnapshot.load(session, macro_metric_table, "macrometric", "macrometricvalue")
+
+
+def fetch_and_insert_macro_metrics_data(session: sqlalchemy.orm.Session,
+                                        macro_metrics: List[Dict[str, str]],
+                                        watermarks: Optional[WatermarkSnapshot] = None,
+                                        cache: Optional[MarketDataCache] = None,
+                                        prefetched: Optional[Dict[str, pd.DataFrame]] = None,
+                                        revision_lookback_days: int = REVISION_LOOKBACK_DAYS):
+    """Fetch new and revised observations for every macro metric and store them.
+
+    Series sharing the same fetch window are requested together. Series found in
+    prefetched (keyed by symbol) are stored without fetching them again. Only rows
+    whose value or change differs from the stored one are written.
+    """
+    macro_metric_table = sqlalchemy.Table('macrometricdata', sqlalchemy.MetaData(), autoload_with=session.bind)
+    watermarks = watermarks or load_macro_metric_watermarks(session)
+    requests_session = create_rate_limited_session()
+
+    groups = group_macro_metric_jobs(
+        plan_macro_metric_jobs(macro_metrics, watermarks, revision_lookback_days=revision_lookback_days)
+    )
+    logging.info(f"Fetching {sum(len(group) for group in groups)} macro series in {len(groups)} requests")
+    for group in groups:
+        if prefetched is not None:
+            macro_metrics_data = prefetched
+        else:
+            macro_metrics_data = fetch_macro_metric_group(group, cache, requests_session)
+
+        # What is stored inside the window and the last value before it, for the whole group
+        start = group[0]["start"]
+        symbols = [job["symbol"] for job in group]
+        stored = load_stored_macro_metrics(session, macro_metric_table, symbols, start)
+        anchors = WatermarkSnapshot.load(
+            session, macro_metric_table, "macrometric", "macrometricvalue", keys=symbols, before=start
+        )
+
+        for job in group:
+            upsert_macro_metric_data(
+                session,
+                macro_metric_table,
+                job["symbol"],
+                job["description"],
+                macro_metrics_data.get(job["symbol"], pd.DataFrame()),
+                anchors.last_value(job["symbol"]),
+                stored.get(job["symbol"]),
+            )
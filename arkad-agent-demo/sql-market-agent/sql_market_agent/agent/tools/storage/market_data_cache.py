@@ -0,0 +1,51 @@
+import hashlib
+import pandas as pd
+from pathlib import Path
+from typing import Optional
+
+
+class MarketDataCache:
+    """Raw upstream responses stored as Parquet, one file per source, symbol and range.
+
+    Files are addressed by a hash of the request (source, symbol, start, end). In replay
+    mode nothing is requested upstream: a request without an exact match is served from
+    every cached range of the symbol, sliced to [start, end), or [start, end] for sources
+    whose upstream end date is inclusive.
+    """
+
+    # FRED returns the observation dated end, yfinance stops the day before
+    INCLUSIVE_END_SOURCES = {"fred"}
+
+    def __init__(self, cache_dir: str, replay: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.replay = replay
+
+    def path_for(self, source: str, symbol: str, start: str, end: str) -> Path:
+        key = hashlib.sha256(f"{source}|{symbol}|{start}|{end}".encode()).hexdigest()[:16]
+        # Documents that aren't fetched by date range have empty start and end
+        name = "_".join(part for part in [start, end, key] if part)
+        return self.cache_dir / source / symbol / f"{name}.parquet"
+
+    def load(self, source: str, symbol: str, start: str, end: str) -> Optional[pd.DataFrame]:
+        path = self.path_for(source, symbol, start, end)
+        if path.exists():
+            return pd.read_parquet(path)
+        if self.replay:
+            return self.load_covering(source, symbol, start, end)
+        return None
+
+    def load_covering(self, source: str, symbol: str, start: str, end: str) -> Optional[pd.DataFrame]:
+        paths = sorted((self.cache_dir / source / symbol).glob("*.parquet"))
+        if not paths:
+            return None
+
+        data = pd.concat([pd.read_parquet(path) for path in paths])
+        data = data[~data.index.duplicated(keep="last")].sort_index()
+        dates = data.index.strftime("%Y-%m-%d")
+        before_end = dates <= end if source in self.INCLUSIVE_END_SOURCES else dates < end
+        return data[(dates >= start) & before_end]
+
+    def store(self, source: str, symbol: str, start: str, end: str, data: pd.DataFrame):
+        path = self.path_for(source, symbol, start, end)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data.to_parquet(path)
@@ -0,0 +1,190 @@
+import time
+import threading
+import logging
+import requests
+from collections import defaultdict
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Requests per second allowed per host, SEC publishes its fair access limit of 10/s
+HOST_RATE_LIMITS = {
+    "data.sec.gov": 10,
+    "www.sec.gov": 10,
+    "query1.finance.yahoo.com": 5,
+    "query2.finance.yahoo.com": 5,
+    "fc.yahoo.com": 5,
+    "fred.stlouisfed.org": 5,
+}
+DEFAULT_RATE_LIMIT = 5
+# Hosts whose limit holds over any second, their buckets hold a single token so
+# requests are evenly spaced instead of bursting a second's worth at once
+NO_BURST_HOSTS = {"data.sec.gov", "www.sec.gov"}
+# Retries on throttled responses shared by all hosts until the limiter is reset (once
+# per fetch run), so a blocked source can't stall a run with endless backoff
+DEFAULT_RETRY_BUDGET = 100
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_BACKOFF_SECONDS = 60
+
+
+class TokenBucket:
+    """Token bucket whose rate halves on throttling and creeps back up on success."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        # By default one second's worth of requests allows short bursts
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.tokens = 0
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+
+class RateLimiter:
+    """Per-host token buckets, a shared retry budget and wait time metrics."""
+
+    def __init__(
+        self,
+        rate_limits: Optional[Dict[str, float]] = None,
+        default_rate: float = DEFAULT_RATE_LIMIT,
+        retry_budget: int = DEFAULT_RETRY_BUDGET,
+    ):
+        self.rate_limits = rate_limits if rate_limits is not None else HOST_RATE_LIMITS
+        self.default_rate = default_rate
+        self.initial_retry_budget = retry_budget
+        self.retry_budget = retry_budget
+        self.buckets = {}
+        self.stats = self.new_stats()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def new_stats() -> Dict[str, Dict]:
+        return defaultdict(lambda: {"requests": 0, "throttled": 0, "retries": 0, "wait_seconds": 0.0})
+
+    def reset(self):
+        """Restore the retry budget and clear the stats, the buckets keep pacing requests."""
+        with self.lock:
+            self.retry_budget = self.initial_retry_budget
+            self.stats = self.new_stats()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(
+                    self.rate_limits.get(host, self.default_rate), 1 if host in NO_BURST_HOSTS else None
+                )
+            return self.buckets[host]
+
+    def acquire(self, host: str):
+        waited = self.bucket(host).acquire()
+        with self.lock:
+            self.stats[host]["requests"] += 1
+            self.stats[host]["wait_seconds"] += waited
+
+    def take_retry(self, host: str) -> bool:
+        with self.lock:
+            self.stats[host]["throttled"] += 1
+            if self.retry_budget <= 0:
+                return False
+            self.retry_budget -= 1
+            self.stats[host]["retries"] += 1
+            return True
+
+    def backoff(self, host: str, attempt: int, retry_after: Optional[str] = None):
+        self.bucket(host).slow_down()
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = 2 ** attempt
+        delay = min(delay, MAX_BACKOFF_SECONDS)
+        time.sleep(delay)
+        with self.lock:
+            self.stats[host]["wait_seconds"] += delay
+
+    def succeeded(self, host: str):
+        self.bucket(host).speed_up()
+
+    def log_stats(self):
+        with self.lock:
+            for host, stats in sorted(self.stats.items()):
+                logging.info(
+                    f"{host}: {stats['requests']} requests, {stats['throttled']} throttled, "
+                    f"{stats['retries']} retries, {stats['wait_seconds']:.1f}s waiting"
+                )
+
+
+# Every ingestion path shares this limiter so the per-host limits hold across sources and threads
+RATE_LIMITER = RateLimiter()
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter that waits for the host's token bucket and retries throttled responses."""
+
+    def __init__(self, limiter: RateLimiter = RATE_LIMITER, max_attempts: int = 5, **kwargs):
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).hostname
+        attempt = 0
+        while True:
+            self.limiter.acquire(host)
+            response = super().send(request, **kwargs)
+            if response.status_code not in RETRY_STATUSES:
+                self.limiter.succeeded(host)
+                return response
+
+            attempt += 1
+            if attempt >= self.max_attempts or not self.limiter.take_retry(host):
+                return response
+            logging.warning(f"{host} answered {response.status_code}, backing off (attempt {attempt})")
+            self.limiter.backoff(host, attempt, response.headers.get("Retry-After"))
+            response.close()
+
+
+def create_rate_limited_session(
+    limiter: RateLimiter = RATE_LIMITER,
+    retries: int = 3,
+    backoff_factor: float = 0.3,
+    pool_maxsize: int = 10,
+) -> requests.Session:
+    session = requests.Session()
+    # urllib3 only retries connection and read errors, throttled responses go through the limiter
+    retry = Retry(
+        total=retries,
+        read=retries,
+        connect=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(),
+        respect_retry_after_header=False,
+    )
+    adapter = RateLimitedAdapter(limiter, max_retries=retry, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -1,8 +1,9 @@
 import requests
 import os
-import json
 import logging
 from dotenv import load_dotenv
+from sql_market_agent.agent.tools.storage.rate_limiter import create_rate_limited_session, RATE_LIMITER
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.cik_index import CikIndex
 
 load_dotenv()
 
@@ -10,10 +11,11 @@ load_dotenv()
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def download_json(url, headers):
+def download_json(url, headers, session=None):
     """Download JSON data from the given URL."""
+    session = session or create_rate_limited_session()
     try:
-        response = requests.get(url, headers=headers)
+        response = session.get(url, headers=headers)
         response.raise_for_status()  # Raise an exception for HTTP errors
         return response.json()
     except requests.exceptions.HTTPError as errh:
@@ -38,15 +40,8 @@ def transform_data(data):
             }
     return transformed
 
-def save_to_json(data, file_name):
-    """Save data to a JSON file."""
-    try:
-        with open(file_name, 'w') as file:
-            json.dump(data, file, indent=4)
-        logging.info(f"Data successfully saved to {file_name}")
-    except IOError as e:
-        logging.error(f"I/O error({e.errno}): {e.strerror}")
-
+# Imports are absolute, so run it as a module from the project root:
+# python -m sql_market_agent.agent.tools.storage.stocks.sec_forms.cik_fetcher
 def main():
     """Main function to orchestrate the download and transformation process."""
     logging.info("Starting the download process.")
@@ -56,7 +51,9 @@ def main():
     json_data = download_json(url, headers)
     if json_data:
         transformed_data = transform_data(json_data)
-        save_to_json(transformed_data, 'tickers_cik_info.json')
+        # Only tickers whose CIK or title changed are written
+        CikIndex().refresh(transformed_data)
+    RATE_LIMITER.log_stats()
     logging.info("Process completed.")
 
 if __name__ == "__main__":
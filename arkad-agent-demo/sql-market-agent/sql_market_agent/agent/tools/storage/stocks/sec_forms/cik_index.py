@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Written at runtime, so it lives outside the package directory, which may be read-only.
+# The CIK_INDEX_PATH environment variable points it elsewhere.
+DEFAULT_CIK_INDEX_PATH = Path.home() / ".cache" / "sql_market_agent" / "tickers_cik_info.db"
+# Ticker to CIK snapshot shipped with the package, seeds an index that was never refreshed
+CIK_SEED_PATH = Path(__file__).parent / "tickers_cik_info.json"
+# Stays below SQLite's default limit on variables per statement
+LOOKUP_CHUNK = 500
+
+
+def read_tickers_json(file_path: Path) -> Dict[str, Dict]:
+    try:
+        with open(file_path, 'r') as file:
+            return json.load(file)
+    except IOError as e:
+        logging.error(f"Error reading {file_path}: {e}")
+        return {}
+
+
+def create_schema(connection: sqlite3.Connection):
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS tickercik ("
+        "ticker TEXT PRIMARY KEY, cik INTEGER NOT NULL, title TEXT COLLATE NOCASE"
+        ") WITHOUT ROWID"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS tickercik_title ON tickercik (title)")
+
+
+class CikIndex:
+    """Ticker to CIK and company title lookup, persisted as a small SQLite file.
+
+    Tickers are the primary key and titles carry a case insensitive index, so resolving
+    a ticker or a company name reads a few pages instead of parsing every listed company.
+    The file is created and seeded on first use, lookups then only open it read-only.
+    """
+
+    def __init__(self, index_path: Optional[Path] = None, seed_path: Optional[Path] = CIK_SEED_PATH):
+        self.index_path = Path(index_path or os.environ.get("CIK_INDEX_PATH") or DEFAULT_CIK_INDEX_PATH)
+        self.seed_path = seed_path
+
+    def create(self):
+        """Create the index from the seed unless it exists."""
+        if self.index_path.exists():
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        # Built under a name of this process, so concurrent readers never open a half-seeded index
+        partial = self.index_path.with_name(f".{self.index_path.name}.{os.getpid()}.partial")
+        with closing(sqlite3.connect(partial)) as connection:
+            connection.row_factory = sqlite3.Row
+            with connection:
+                create_schema(connection)
+            if self.seed_path:
+                self.apply(connection, read_tickers_json(self.seed_path))
+        partial.replace(self.index_path)
+
+    def connect(self, read_only: bool = True) -> sqlite3.Connection:
+        self.create()
+        if read_only:
+            connection = sqlite3.connect(f"{self.index_path.resolve().as_uri()}?mode=ro", uri=True)
+        else:
+            connection = sqlite3.connect(self.index_path)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def apply(self, connection: sqlite3.Connection, tickers: Dict[str, Dict]) -> Tuple[int, int]:
+        """Write the entries of tickers that differ from the index and drop tickers no longer listed."""
+        current = {
+            row["ticker"]: (row["cik"], row["title"])
+            for row in connection.execute("SELECT ticker, cik, title FROM tickercik")
+        }
+        listed = {
+            ticker: (int(info["cik_str"]), info.get("title"))
+            for ticker, info in tickers.items()
+            if info.get("cik_str") is not None
+        }
+        changed = [
+            (ticker, cik, title)
+            for ticker, (cik, title) in listed.items()
+            if current.get(ticker) != (cik, title)
+        ]
+        removed = [(ticker,) for ticker in current if ticker not in listed]
+
+        with connection:
+            connection.executemany(
+                "INSERT INTO tickercik (ticker, cik, title) VALUES (?, ?, ?) "
+                "ON CONFLICT (ticker) DO UPDATE SET cik = excluded.cik, title = excluded.title",
+                changed,
+            )
+            connection.executemany("DELETE FROM tickercik WHERE ticker = ?", removed)
+        logging.info(
+            f"CIK index: {len(changed)} tickers added or changed, {len(removed)} removed, "
+            f"{len(listed)} listed"
+        )
+        return len(changed), len(removed)
+
+    def refresh(self, tickers: Dict[str, Dict]) -> Tuple[int, int]:
+        """Bring the index in line with tickers, keyed by ticker like cik_fetcher.transform_data's output.
+
+        An empty download would remove every ticker, so it leaves the index as it is.
+        """
+        if not tickers:
+            logging.warning("No tickers to refresh the CIK index from, keeping it unchanged")
+            return 0, 0
+        with closing(self.connect(read_only=False)) as connection:
+            return self.apply(connection, tickers)
+
+    def lookup(self, ticker: str) -> Optional[Dict]:
+        return self.lookup_many([ticker]).get(ticker)
+
+    def lookup_many(self, tickers: Iterable[str]) -> Dict[str, Dict]:
+        """CIK and title of each ticker in the index, unknown tickers are left out."""
+        tickers = list(dict.fromkeys(tickers))
+        found = {}
+        with closing(self.connect()) as connection:
+            for i in range(0, len(tickers), LOOKUP_CHUNK):
+                chunk = tickers[i:i + LOOKUP_CHUNK]
+                rows = connection.execute(
+                    f"SELECT ticker, cik, title FROM tickercik "
+                    f"WHERE ticker IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                found.update((row["ticker"], dict(row)) for row in rows)
+        return found
+
+    def find_by_title(self, title: str, prefix: bool = False) -> List[Dict]:
+        """Tickers of the companies named title, or whose name starts with it, ignoring case."""
+        with closing(self.connect()) as connection:
+            if prefix:
+                # LIKE is case insensitive for ASCII like the column's collation, so it can use the index
+                pattern = title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                rows = connection.execute(
+                    "SELECT ticker, cik, title FROM tickercik WHERE title LIKE ? ESCAPE '\\' "
+                    "ORDER BY title, ticker",
+                    (pattern,),
+                )
+            else:
+                rows = connection.execute(
+                    "SELECT ticker, cik, title FROM tickercik WHERE title = ? ORDER BY ticker",
+                    (title,),
+                )
+            return [dict(row) for row in rows]
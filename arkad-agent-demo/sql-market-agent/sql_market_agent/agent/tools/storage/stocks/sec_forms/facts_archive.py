@@ -0,0 +1,113 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# Fields of SEC's companyfacts unit records, plus the report type and concept they were filtered from
+FACTS_SCHEMA = pa.schema(
+    [
+        ("reporttype", pa.string()),
+        ("concept", pa.string()),
+        ("start", pa.string()),
+        ("end", pa.string()),
+        ("val", pa.float64()),
+        ("accn", pa.string()),
+        ("fy", pa.int64()),
+        ("fp", pa.string()),
+        ("form", pa.string()),
+        ("filed", pa.string()),
+        ("frame", pa.string()),
+    ]
+)
+
+
+class FactsArchive:
+    """Filtered company facts as zstd compressed Parquet, one file per symbol.
+
+    Each report type is its own row group, so the index (built from the files' footers)
+    locates a symbol's concept without reading its other records, and reads are memory
+    mapped.
+    """
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = Path(archive_dir)
+
+    def path_for(self, symbol: str) -> Path:
+        return self.archive_dir / f"{symbol}.parquet"
+
+    def __contains__(self, symbol: str) -> bool:
+        return self.path_for(symbol).exists()
+
+    def symbols(self) -> List[str]:
+        return sorted(path.stem for path in self.archive_dir.glob("*.parquet"))
+
+    def write(self, symbol: str, records: List[Dict]):
+        table = pa.Table.from_pylist(records, schema=FACTS_SCHEMA)
+        # Report types in order of appearance, records keep their order within one
+        reporttypes = list(dict.fromkeys(table.column("reporttype").to_pylist()))
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(symbol)
+        partial = path.with_suffix(".parquet.partial")
+        with pq.ParquetWriter(partial, FACTS_SCHEMA, compression="zstd") as writer:
+            for reporttype in reporttypes:
+                if reporttype is None:
+                    mask = table.column("reporttype").is_null()
+                else:
+                    mask = pc.equal(table.column("reporttype"), reporttype)
+                writer.write_table(table.filter(mask), row_group_size=table.num_rows)
+        partial.replace(path)
+
+    def row_groups(self, facts: pq.ParquetFile) -> Dict[Optional[str], int]:
+        metadata = facts.metadata
+        reporttype_column = FACTS_SCHEMA.get_field_index("reporttype")
+        row_groups = {}
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(reporttype_column).statistics
+            row_groups[statistics.min if statistics.has_min_max else None] = i
+        return row_groups
+
+    def index(self, symbols: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Symbol, report type, row group and record count of every archived concept."""
+        rows = []
+        for symbol in symbols or self.symbols():
+            facts = pq.ParquetFile(self.path_for(symbol), memory_map=True)
+            for reporttype, i in self.row_groups(facts).items():
+                rows.append((symbol, reporttype, i, facts.metadata.row_group(i).num_rows))
+        return pd.DataFrame(rows, columns=["symbol", "reporttype", "rowgroup", "records"])
+
+    def read(
+        self,
+        symbol: str,
+        reporttypes: Optional[Iterable[str]] = None,
+        columns: Optional[List[str]] = None,
+    ) -> Optional[List[Dict]]:
+        """Records of symbol in the shape SEC serves them, optionally only some report types and fields."""
+        if symbol not in self:
+            return None
+
+        facts = pq.ParquetFile(self.path_for(symbol), memory_map=True)
+        row_groups = self.row_groups(facts)
+        if reporttypes is not None:
+            row_groups = {reporttype: row_groups[reporttype] for reporttype in reporttypes if reporttype in row_groups}
+        if columns is not None:
+            # Files archived before a field was added are read without it
+            columns = [column for column in columns if column in facts.schema_arrow.names]
+        table = facts.read_row_groups(sorted(row_groups.values()), columns=columns)
+
+        # Building Python objects is most of the cost of a read, numpy converts strings
+        # (nulls to None) and complete columns several times faster than to_pylist
+        names = table.column_names
+        values = [
+            column.to_numpy(zero_copy_only=False).tolist()
+            if pa.types.is_string(column.type) or column.null_count == 0
+            else column.to_pylist()
+            for column in table.columns
+        ]
+        # Missing keys (e.g. 'frame') are stored as nulls, drop them to get the SEC shape back
+        return [
+            {key: value for key, value in zip(names, record) if value is not None}
+            for record in zip(*values)
+        ]
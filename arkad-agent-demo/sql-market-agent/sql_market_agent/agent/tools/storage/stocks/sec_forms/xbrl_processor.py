@@ -1,18 +1,35 @@
 import os
 import requests
-import json
+import ijson
+import urllib3
 import logging
+import multiprocessing
 import traceback
+import zipfile
 import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy import select
 from dotenv import load_dotenv
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import pandas as pd
-from datetime import datetime, date
-from typing import List, Dict, Optional
-from pathlib import Path
-from sqlalchemy import insert
-from sqlalchemy.dialects.postgresql import insert as insert_postgres
+import pyarrow as pa
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import lru_cache
+from datetime import date
+from typing import List, Dict, Iterator, Optional, Tuple
+from sql_market_agent.agent.tools.storage.bulk_loader import insert_rows, commit_progress, upsert_rows
+from sql_market_agent.agent.tools.storage.market_data_cache import MarketDataCache
+from sql_market_agent.agent.tools.storage.rate_limiter import create_rate_limited_session
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.cik_index import CikIndex
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.earnings_dataset import EarningsDataset
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.facts_archive import FactsArchive
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.filing_state import (
+    changed_since,
+    get_periodic_filings,
+    load_filing_state,
+    record_filing_state,
+)
 
 # Load environment variables
 load_dotenv()
@@ -23,86 +40,279 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Constants
 HEADERS = {'User-Agent': os.environ.get("EMAIL")}
 COMPANY_FACTS_URL = 'https://data.sec.gov/api/xbrl/companyfacts/CIK{}.json'
-KEYS_TO_KEEP = {
-    "us-gaap": [
-        "Revenues", 
-        "SalesRevenueNet", 
-        "SalesRevenueGoodsNet",
-        "SalesRevenueServicesNet",
-        "RevenuesNetOfInterestExpense",
-        "OperatingRevenues",
-        "RevenueNotFromContractWithCustomer",
-        "RevenueFromContractWithCustomerExcludingAssessedTax",
-        "TotalRevenue",
-        "RevenueMineralSales",
-        "OilAndGasRevenue",
-        "RegulatedAndUnregulatedOperatingRevenue",
-        "FranchiseRevenue",
-        "InterestAndDividendRevenueOperating",
-        "RealEstateRevenueNet",
-        "AdvertisingRevenue"
-    ]
+FINANCIAL_DATA_KEY = ['symbol', 'sector', 'year', 'reporttype', 'period']
+FINANCIAL_FRAME_COLUMNS = FINANCIAL_DATA_KEY + ['amount']
+# Quarter estimates fall back to the reported FY of up to two years later
+ESTIMATE_LOOKAHEAD_YEARS = 2
+# Fact fields the estimation reads
+ESTIMATION_COLUMNS = ["reporttype", "concept", "start", "end", "val", "fp", "filed", "frame"]
+# Earnings files written under earnings_data_path: one CSV per symbol, or a Parquet
+# dataset of all companies partitioned by sector and year
+EARNINGS_FORMATS = ("csv", "parquet")
+# Report types written to StockFinancialData and the XBRL concepts blended into each,
+# where several report a period the first listed concept wins.
+# Additive concepts (flows over a period) get missing quarters and years estimated,
+# the others are only stored for the periods the filings report. Estimated quarters
+# are floored at 0 unless the concept is signed (can be a loss or an outflow).
+CONCEPT_MAP = {
+    "Revenue": {
+        "taxonomy": "us-gaap",
+        "unit": "USD",
+        "additive": True,
+        "signed": False,
+        "concepts": [
+            "Revenues", 
+            "SalesRevenueNet", 
+            "SalesRevenueGoodsNet",
+            "SalesRevenueServicesNet",
+            "RevenuesNetOfInterestExpense",
+            "OperatingRevenues",
+            "RevenueNotFromContractWithCustomer",
+            "RevenueFromContractWithCustomerExcludingAssessedTax",
+            "TotalRevenue",
+            "RevenueMineralSales",
+            "OilAndGasRevenue",
+            "RegulatedAndUnregulatedOperatingRevenue",
+            "FranchiseRevenue",
+            "InterestAndDividendRevenueOperating",
+            "RealEstateRevenueNet",
+            "AdvertisingRevenue"
+        ],
+    },
+    "NetIncome": {
+        "taxonomy": "us-gaap",
+        "unit": "USD",
+        "additive": True,
+        "signed": True,
+        "concepts": ["NetIncomeLoss", "ProfitLoss"],
+    },
+    "OperatingIncome": {
+        "taxonomy": "us-gaap",
+        "unit": "USD",
+        "additive": True,
+        "signed": True,
+        "concepts": ["OperatingIncomeLoss"],
+    },
+    "OperatingCashFlow": {
+        "taxonomy": "us-gaap",
+        "unit": "USD",
+        "additive": True,
+        "signed": True,
+        "concepts": [
+            "NetCashProvidedByUsedInOperatingActivities",
+            "NetCashProvidedByUsedInOperatingActivitiesContinuingOperations",
+        ],
+    },
+    "EPS": {
+        "taxonomy": "us-gaap",
+        "unit": "USD/shares",
+        "additive": False,
+        "concepts": ["EarningsPerShareDiluted", "EarningsPerShareBasic"],
+    },
+    "SharesOutstanding": {
+        "taxonomy": "dei",
+        "unit": "shares",
+        "additive": False,
+        "concepts": ["EntityCommonStockSharesOutstanding"],
+    },
 }
 
-def create_session(retries: int = 3, backoff_factor: float = 0.3) -> requests.Session:
-    session = requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=(500, 502, 504),
+def create_session(retries: int = 3, backoff_factor: float = 0.3, pool_maxsize: int = 10) -> requests.Session:
+    # Throttled by the shared limiter to SEC's 10 requests per second
+    return create_rate_limited_session(
+        retries=retries, backoff_factor=backoff_factor, pool_maxsize=pool_maxsize
     )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
 
 
-def load_cik_info(file_path: str) -> Dict:
-    try:
-        with open(file_path, 'r') as file:
-            return json.load(file)
-    except IOError as e:
-        logging.error(f"Error reading {file_path}: {e}")
-        return {}
+def extract_company_facts(stream, concept_map: Dict[str, Dict] = CONCEPT_MAP) -> Dict:
+    """Parse a companyfacts document from a stream, keeping only the mapped concepts in their unit.
+
+    Returns the same shape as the full document, so only one fact at a time is held
+    in memory beyond the kept records, plus under "filed" the latest filing date of
+    any fact, mapped or not.
+    """
+    keys_to_keep = {}
+    unit_arrays = {}
+    for spec in concept_map.values():
+        taxonomy = spec["taxonomy"]
+        keys_to_keep.setdefault(taxonomy, set()).update(spec["concepts"])
+        for concept in spec["concepts"]:
+            unit_arrays[f"facts.{taxonomy}.{concept}.units.{spec['unit']}"] = (taxonomy, concept, spec["unit"])
+    taxonomies = {f"facts.{taxonomy}": taxonomy for taxonomy in keys_to_keep}
+    records = {f"{prefix}.item": key for prefix, key in unit_arrays.items()}
+
+    facts = {}
+    latest_filed = None
+    builder, building = None, None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if event == "string" and prefix.endswith(".item.filed") and (latest_filed is None or value > latest_filed):
+            latest_filed = value
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == building and event == "end_map":
+                taxonomy, concept, unit = records[prefix]
+                facts[taxonomy][concept]["units"][unit].append(builder.value)
+                builder = None
+        elif prefix in records and event == "start_map":
+            builder, building = ijson.ObjectBuilder(), prefix
+            builder.event(event, value)
+        elif prefix in taxonomies and event == "start_map":
+            facts[taxonomies[prefix]] = {}
+        elif prefix in taxonomies and event == "map_key" and value in keys_to_keep[taxonomies[prefix]]:
+            facts[taxonomies[prefix]][value] = {"units": {}}
+        elif prefix in unit_arrays and event == "start_array":
+            taxonomy, concept, unit = unit_arrays[prefix]
+            facts[taxonomy][concept]["units"][unit] = []
+    return {"facts": facts, "filed": latest_filed}
 
 
 def get_company_facts(session: requests.Session, cik: str):
+    # Streamed, the full document of a large filer is hundreds of MB once parsed
     try:
-        response = session.get(COMPANY_FACTS_URL.format(cik), headers=HEADERS)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        with session.get(COMPANY_FACTS_URL.format(cik), headers=HEADERS, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return extract_company_facts(response.raw)
+    # Reading raw, errors in the middle of the body come from urllib3 rather than requests
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
         logging.error(f"Request failed for CIK {cik}: {e}")
         return None
+    except ijson.JSONError as e:
+        logging.error(f"Invalid company facts for CIK {cik}: {e}")
+        return None
 
 
-def filter_facts(company_facts: Dict) -> List[Dict]:
-    # Convert lists to sets and find intersection
-    common_elements = set(KEYS_TO_KEEP["us-gaap"]) & set(company_facts["facts"]["us-gaap"])
-
-    revenue_records = []
-    # Check if there is any common element
-    if common_elements:
+def filter_facts(company_facts: Dict, concept_map: Dict[str, Dict] = CONCEPT_MAP) -> List[Dict]:
+    """Blend each report type's concept aliases into one list of records tagged with reporttype and concept."""
+    financial_records = []
+    missing = []
+    for reporttype, spec in concept_map.items():
+        taxonomy_facts = company_facts["facts"].get(spec["taxonomy"], {})
+        common_elements = [concept for concept in spec["concepts"] if concept in taxonomy_facts]
+        if not common_elements:
+            missing.append(reporttype)
         for element in common_elements:
             try:
-                revenue_records = revenue_records + company_facts["facts"]["us-gaap"][element]["units"]["USD"]
+                for record in taxonomy_facts[element]["units"][spec["unit"]]:
+                    record["reporttype"] = reporttype
+                    record["concept"] = element
+                    financial_records.append(record)
             except KeyError as e:
-                logging.warning(f"Key error while blending Revenues aliases: {e}")
-        return revenue_records
-    else:
-        logging.warning(f"Missing required data categories for Revenues")
-        return None
+                logging.warning(f"Key error while blending {reporttype} aliases: {e}")
+
+    if missing:
+        logging.warning(f"Missing required data categories for {', '.join(missing)}")
+    return financial_records or None
+
+
+def records_from_frame(df: pd.DataFrame) -> List[Dict]:
+    # Parquet stores missing keys (e.g. 'frame') as nulls, drop them to get the SEC shape back
+    return [
+        {key: value for key, value in record.items() if not pd.isna(value)}
+        for record in df.to_dict(orient="records")
+    ]
+
+
+def get_company_records(requests_session: requests.Session,
+                        cik: str,
+                        symbol: str,
+                        cache: Optional[MarketDataCache] = None) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Return the company's mapped records and the latest filing date of its facts (None when unknown)."""
+    # Filings change over time, so the cache is only read back in replay mode
+    if cache and cache.replay:
+        cached = cache.load("sec", symbol, "", "")
+        if cached is None:
+            logging.warning(f"Replay mode: no cached company facts for {symbol}, skipping")
+            return None, None
+        return records_from_frame(cached), None
+
+    company_facts = get_company_facts(requests_session, cik)
+
+    if not company_facts:
+        logging.warning(f"No company facts for {symbol}, skipping...")
+        return None, None
+
+    if "us-gaap" not in company_facts["facts"]:
+        logging.warning(f"No 'us-gaap' data in {symbol} facts, skipping...")
+        return None, company_facts.get("filed")
+
+    filtered_facts = filter_facts(company_facts)
+    if filtered_facts and cache:
+        cache.store("sec", symbol, "", "", pd.DataFrame(filtered_facts))
+    return filtered_facts, company_facts.get("filed")
+
+
+def get_revenue_records(requests_session: requests.Session,
+                        cik: str,
+                        symbol: str,
+                        cache: Optional[MarketDataCache] = None) -> Optional[List[Dict]]:
+    return get_company_records(requests_session, cik, symbol, cache)[0]
+
+
+@lru_cache(maxsize=1)
+def open_companyfacts_archive(zip_path: str) -> zipfile.ZipFile:
+    # Reading the central directory of the bulk archive once per worker process
+    return zipfile.ZipFile(zip_path)
+
+
+def companyfacts_member(cik: str) -> str:
+    return f"CIK{cik}.json"
 
 
-def save_facts_to_file(facts: Dict, symbol: str, facts_data_path: str):
-    path_to_file = f"{facts_data_path}/{symbol}.json"
+def read_company_records_from_archive(zip_path: str, cik: str) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Stream one company's member of the bulk archive, see get_company_records."""
     try:
-        with open(f"{facts_data_path}/{symbol}.json", 'w') as file:
-            json.dump(facts, file, indent=4)
+        with open_companyfacts_archive(zip_path).open(companyfacts_member(cik)) as stream:
+            company_facts = extract_company_facts(stream)
+    except (KeyError, ijson.JSONError) as e:
+        logging.error(f"Can't read company facts for CIK {cik} from {zip_path}: {e}")
+        return None, None
+
+    if "us-gaap" not in company_facts["facts"]:
+        logging.warning(f"No 'us-gaap' data in CIK {cik} facts, skipping...")
+        return None, company_facts.get("filed")
+    return filter_facts(company_facts), company_facts.get("filed")
+
+
+def process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    # Spawned rather than forked, download threads may hold locks a forked worker would inherit
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def iter_revenue_records_from_archive(zip_path: str,
+                                      jobs: List[Dict],
+                                      max_workers: Optional[int] = None) -> Iterator[Tuple[Dict, Optional[List[Dict]]]]:
+    """Yield (job, records) for every job, parsing archive members across processes.
+
+    Only members of the jobs' CIKs are read, results arrive in completion order.
+    Jobs come back with facts_filed, see get_company_records.
+    """
+    # Not the cached archive, workers open the file themselves
+    with zipfile.ZipFile(zip_path) as archive:
+        members = set(archive.namelist())
+    in_archive = [job for job in jobs if companyfacts_member(job['cik']) in members]
+    for job in jobs:
+        if companyfacts_member(job['cik']) not in members:
+            logging.warning(f"No company facts for {job['symbol']} in {zip_path}")
+            yield job, None
+
+    with process_pool(max_workers) as executor:
+        futures = {
+            executor.submit(read_company_records_from_archive, zip_path, job['cik']): job
+            for job in in_archive
+        }
+        for future in as_completed(futures):
+            records, facts_filed = future.result()
+            yield {**futures[future], "facts_filed": facts_filed}, records
+
+
+def save_facts_to_file(facts: List[Dict], symbol: str, facts_data_path: str):
+    archive = FactsArchive(facts_data_path)
+    path_to_file = archive.path_for(symbol)
+    try:
+        archive.write(symbol, facts)
         logging.info(f"Data successfully saved to {path_to_file}")
-    except IOError as e:
+    except (IOError, pa.ArrowException) as e:
         logging.error(f"Error saving to {path_to_file}: {e}")
 
 
@@ -115,37 +325,53 @@ def months_diff(start: date, end: date) -> int:
     return (end.year - start.year) * 12 + end.month - start.month
 
 
-def find_record_by_fp(records: List[Dict], year: int, fp: str) -> Dict:
-    for record in records:
-        if record['fp'] == fp and 'frame' not in record:
-            start_date = datetime.strptime(record["start"], "%Y-%m-%d")
-            end_date = datetime.strptime(record["end"], "%Y-%m-%d")
-            if end_date.year == year and months_diff(start_date, end_date) > 5:
-                return record
-    return None
-
-
-def calculate_historical_proportions(records: List[Dict], year: int, quarter: str) -> float:
-    historical_totals = {q: [] for q in ['Q1', 'Q2', 'Q3', 'Q4']}
-    for record in records:
-        if 'frame' in record and record['frame'].startswith(f'CY{year - 1}') and 'Q' in record['frame']:
-            historical_totals[record['frame'][-2:]].append(record['val'])
-
-    avg_proportions = {q: sum(vals) / len(vals) if vals else 0 for q, vals in historical_totals.items()}
-    total_avg = sum(avg_proportions.values())
-    return avg_proportions[quarter] / total_avg if total_avg else 0
-
-
-def estimate_quarter(records: List[Dict], available_data: Dict, year: int, quarter: str) -> float:
-    next_q_record = find_record_by_fp(records, year, f'Q{int(quarter[1]) % 4 + 1}')
+class RecordIndex:
+    """One pass over a company's records, so estimation lookups don't rescan them."""
+
+    def __init__(self, records: List[Dict]):
+        # First cumulative (> 5 months, unframed) record per fiscal period and end year
+        self.cumulative_records = {}
+        # Values of framed quarters per calendar year and quarter
+        self.quarter_values = {}
+        self.proportions = {}
+
+        for record in records:
+            frame = record.get('frame')
+            if frame is None:
+                # fromisoformat parses SEC's YYYY-MM-DD dates many times faster than strptime
+                start_date = date.fromisoformat(record["start"])
+                end_date = date.fromisoformat(record["end"])
+                if months_diff(start_date, end_date) > 5:
+                    self.cumulative_records.setdefault((record.get('fp'), end_date.year), record)
+            elif frame.startswith('CY') and 'Q' in frame:
+                self.quarter_values.setdefault((int(frame[2:6]), frame[-2:]), []).append(record['val'])
+
+    def find_record_by_fp(self, year: int, fp: str) -> Optional[Dict]:
+        return self.cumulative_records.get((fp, year))
+
+    def calculate_historical_proportions(self, year: int, quarter: str) -> float:
+        if year not in self.proportions:
+            avg_proportions = {}
+            for q in ['Q1', 'Q2', 'Q3', 'Q4']:
+                vals = self.quarter_values.get((year - 1, q), [])
+                avg_proportions[q] = sum(vals) / len(vals) if vals else 0
+            self.proportions[year] = avg_proportions
+
+        avg_proportions = self.proportions[year]
+        total_avg = sum(avg_proportions.values())
+        return avg_proportions[quarter] / total_avg if total_avg else 0
+
+
+def estimate_quarter(index: RecordIndex, available_data: Dict, year: int, quarter: str, signed: bool = False) -> float:
+    next_q_record = index.find_record_by_fp(year, f'Q{int(quarter[1]) % 4 + 1}')
     next_q_val = available_data.get(f'CY{year}Q{int(quarter[1]) % 4 + 1}', 0)
 
     if quarter != 'Q4':
         if next_q_record and next_q_val:
             estimated_val = next_q_record['val'] - next_q_val
-            return estimated_val if estimated_val > 0 else 0
+            return estimated_val if signed or estimated_val > 0 else 0
 
-    proportion = calculate_historical_proportions(records, year, quarter)
+    proportion = index.calculate_historical_proportions(year, quarter)
     fy_val = available_data.get(f'CY{year}', 0)
     estimated_val = fy_val * proportion if fy_val else 0
 
@@ -166,49 +392,67 @@ def estimate_quarter(records: List[Dict], available_data: Dict, year: int, quart
             if neighbor_year_val:
                 return neighbor_year_val / 4
 
+    if signed:
+        return estimated_val if estimated_val != 0 else fy_val / 4
     return estimated_val if estimated_val > 0 else fy_val / 4
 
 
-def process_and_insert_revenues_data_for_stock(session: sqlalchemy.orm.Session, 
-                                               records: List[Dict], 
-                                               symbol: str, 
-                                               sector: str,
-                                               earnings_data_path: Optional[str] = None,
-                                               start_year: Optional[int] = None,
-                                               end_year: Optional[int] = None):
-    stock_table = sqlalchemy.Table(
-        "stockfinancialdata", sqlalchemy.MetaData(), autoload_with=session.bind
-    )
-    data_rows = []
+def frame_priority(record: Dict, concept_ranks: Dict[str, int]) -> Tuple[int, str]:
+    """Order of records reporting the same frame: the first listed concept, then the latest filing."""
+    return -concept_ranks.get(record.get("concept"), 0), record.get("filed", "")
 
+
+def estimate_period_amounts(records: List[Dict],
+                            start_year: Optional[int] = None,
+                            end_year: Optional[int] = None,
+                            from_year: Optional[int] = None,
+                            concepts: Optional[List[str]] = None,
+                            signed: bool = False) -> Dict[str, float]:
+    """Return an additive concept per CY frame, estimating quarters and years the filings don't report.
+
+    A year's estimates only depend on reported frames and on the same year, so with
+    from_year only the frames from that year on are estimated and returned.
+    """
     temp_dict = {}
     quarterly_frames = [f'CY{year}Q{q}' for year in range(start_year, end_year) for q in range(1, 5)]
     yearly_frames = [f'CY{year}' for year in range(start_year, end_year)]
+    frames_to_keep = set(quarterly_frames + yearly_frames)
     year_to_available_frames = {year: {} for year in range(start_year, end_year)}
+    concept_ranks = {concept: rank for rank, concept in enumerate(concepts or [])}
 
-    # Consolidating records processing
+    # One record per frame where several concepts or filings report it
+    reported = {}
     for record in records:
         frame = record.get("frame")
-        val = record.get("val")
-        if frame and val:
-            # Update temp_dict for duplicate frame handling
-            if frame in quarterly_frames + yearly_frames and (frame not in temp_dict or val > temp_dict[frame]):
-                temp_dict[frame] = val
-
-            # Update year_to_available_frames for missing quarters calculation
-            if frame.startswith("CY"):
-                year = int(frame[2:6])
-                if year in year_to_available_frames:
-                    year_to_available_frames[year][frame] = val
+        if frame and record.get("val") and (
+            frame not in reported
+            or frame_priority(record, concept_ranks) > frame_priority(reported[frame], concept_ranks)
+        ):
+            reported[frame] = record
+
+    for frame, record in reported.items():
+        if frame in frames_to_keep:
+            temp_dict[frame] = record["val"]
+
+        # Update year_to_available_frames for missing quarters calculation
+        if frame.startswith("CY"):
+            year = int(frame[2:6])
+            if year in year_to_available_frames:
+                year_to_available_frames[year][frame] = record["val"]
 
     available_data = temp_dict
+    index = RecordIndex(records)
+
+    if from_year is not None:
+        quarterly_frames = [frame for frame in quarterly_frames if int(frame[2:6]) >= from_year]
+        yearly_frames = [frame for frame in yearly_frames if int(frame[2:6]) >= from_year]
 
     # Processing for quarters and years
     for frame in quarterly_frames:
         if frame not in available_data:
             year = int(frame[2:6])
             quarter = frame[-2:]
-            available_data[frame] = estimate_quarter(records, available_data, year, quarter)
+            available_data[frame] = estimate_quarter(index, available_data, year, quarter, signed)
 
     for frame in yearly_frames:
         year = int(frame[2:6])
@@ -233,107 +477,479 @@ def process_and_insert_revenues_data_for_stock(session: sqlalchemy.orm.Session,
                 for mq in missing_quarters:
                     available_data[mq] = missing_value_each
 
-    # Preparing data for insertion
-    for frame, amount in available_data.items():
-        year = int(frame[2:6])
-        period = frame[-2:] if 'Q' in frame else 'FY'
-        row = {
+    if from_year is not None:
+        return {frame: value for frame, value in available_data.items() if int(frame[2:6]) >= from_year}
+    return available_data
+
+
+def reported_period_amounts(records: List[Dict],
+                            start_year: Optional[int] = None,
+                            end_year: Optional[int] = None,
+                            from_year: Optional[int] = None,
+                            concepts: Optional[List[str]] = None) -> Dict[str, float]:
+    """Return a non-additive concept per CY frame, only for the frames the filings report."""
+    concept_ranks = {concept: rank for rank, concept in enumerate(concepts or [])}
+    reported = {}
+    for record in records:
+        frame = record.get("frame")
+        if frame and record.get("val") is not None:
+            # Point in time values (e.g. shares outstanding) have instant frames like CY2023Q1I
+            frame = frame.rstrip("I")
+            if max(start_year, from_year or start_year) <= int(frame[2:6]) < end_year and (
+                frame not in reported
+                or frame_priority(record, concept_ranks) > frame_priority(reported[frame], concept_ranks)
+            ):
+                reported[frame] = record
+    return {frame: record["val"] for frame, record in reported.items()}
+
+
+def estimate_financial_amounts(records: List[Dict],
+                               start_year: Optional[int] = None,
+                               end_year: Optional[int] = None,
+                               from_year: Optional[int] = None,
+                               concept_map: Dict[str, Dict] = CONCEPT_MAP) -> Dict[str, Dict[str, float]]:
+    """Return the amounts per CY frame of every report type found in a company's records.
+
+    With from_year only the frames from that year on are computed.
+    """
+    records_by_reporttype = {}
+    for record in records:
+        # Records cached before other concepts were extracted are all revenue
+        records_by_reporttype.setdefault(record.get("reporttype", "Revenue"), []).append(record)
+
+    amounts = {}
+    for reporttype, spec in concept_map.items():
+        if reporttype not in records_by_reporttype:
+            continue
+        if spec["additive"]:
+            amounts[reporttype] = estimate_period_amounts(
+                records_by_reporttype[reporttype], start_year, end_year, from_year,
+                spec["concepts"], spec.get("signed", False),
+            )
+        else:
+            amounts[reporttype] = reported_period_amounts(
+                records_by_reporttype[reporttype], start_year, end_year, from_year, spec["concepts"]
+            )
+    return amounts
+
+
+def build_financial_frame(symbol: str, sector: str, amounts: Dict[str, Dict[str, float]]) -> pd.DataFrame:
+    # Built straight from column arrays rather than one dict per row
+    reporttypes, frames, values = [], [], []
+    for reporttype, available_data in amounts.items():
+        reporttypes += [reporttype] * len(available_data)
+        frames += list(available_data)
+        values += list(available_data.values())
+    return pd.DataFrame(
+        {
             "symbol": symbol,
             "sector": sector,
-            "year": year,
-            "reporttype": "Revenue",
-            "period": period,
-            "amount": amount
+            "year": [int(frame[2:6]) for frame in frames],
+            "reporttype": reporttypes,
+            "period": [frame[-2:] if 'Q' in frame else 'FY' for frame in frames],
+            "amount": values,
         }
-        data_rows.append(row)
-    
-    # Sorting for YoY calculations
-    df = pd.DataFrame(data_rows)
-    df = df.sort_values(by=['symbol', 'sector', 'reporttype', 'period', 'year'])
+    )
+
+
+def previous_period_change(df: pd.DataFrame, previous: pd.DataFrame) -> pd.Series:
+    """Percent change of each row over the amount the previous frame holds for the same key, NaN when missing."""
+    key = ['symbol', 'sector', 'reporttype', 'year', 'period']
+    previous_amount = df[key].merge(
+        previous[key + ['amount']].rename(columns={'amount': 'previous'}), on=key, how='left'
+    )['previous'].set_axis(df.index)
+    return (df['amount'] / previous_amount - 1) * 100
+
+
+def calculate_period_changes(df: pd.DataFrame) -> pd.DataFrame:
+    """Add YoY and QoQ changes to rows of any number of companies and report types in one pass.
+
+    Changes are relative to the actual previous year or quarter, and left empty when that period is missing.
+    Rows come back ordered by symbol, report type, year and quarter, with FY after Q4.
+    """
+    df['quartersort'] = df['period'].map(quarter_sort_key)
+    df = df.sort_values(by=['symbol', 'reporttype', 'year', 'quartersort']).reset_index(drop=True)
 
-    # Calculate YoY change for all periods including FY
-    # We keep your YoY calculation as is since it's working correctly
-    df['yoy'] = df.groupby(['symbol', 'sector', 'reporttype', 'period'])['amount'].pct_change(periods=1) * 100
+    # YoY for all periods including FY, from the same period a year earlier
+    df['yoy'] = previous_period_change(df, df.assign(year=df['year'] + 1))
 
-    # Sorting for QoQ calculations
-    df['quartersort'] = df['period'].apply(quarter_sort_key)
-    df = df.sort_values(by=['year', 'quartersort'])
-    df = df.drop(columns='quartersort')
+    # QoQ over the quarters only, Q1 follows Q4 of the year before and FY rows are left empty
+    quarters = df[df['period'] != 'FY']
+    next_quarter = quarters['quartersort'] % 4 + 1
+    df['qoq'] = previous_period_change(quarters, quarters.assign(
+        year=quarters['year'] + (next_quarter == 1), period='Q' + next_quarter.astype(str)
+    ))
 
-    # Separate DataFrame for QoQ calculation (excluding 'FY')
-    df_qoq = df[df['period'] != 'FY'].copy()
+    return df.drop(columns='quartersort')
 
-    # Calculate QoQ change
-    df_qoq['qoq'] = df_qoq.groupby(['symbol', 'sector', 'reporttype'])['amount'].pct_change() * 100
 
-    # Merge QoQ values back into the original DataFrame
-    df = df.merge(df_qoq[['symbol', 'sector', 'year', 'reporttype', 'period', 'qoq']], on=['symbol', 'sector', 'year', 'reporttype', 'period'], how='left',  suffixes=('', '_y'))
+def export_earnings(df: pd.DataFrame, earnings_data_path: str, earnings_format: str = "csv"):
+    if earnings_format == "parquet":
+        EarningsDataset(earnings_data_path).write(df)
+        return
+    for symbol, symbol_df in df.groupby('symbol', sort=False):
+        symbol_df.reset_index(drop=True).to_csv(f"{earnings_data_path}/{symbol}.csv")
 
-    # Clean up the DataFrame to remove any unwanted columns from the merge
-    df.drop(columns=[col for col in df.columns if col.endswith('_y')], inplace=True)
+
+def insert_financial_frame(session: sqlalchemy.orm.Session,
+                           df: pd.DataFrame,
+                           earnings_data_path: Optional[str] = None,
+                           from_years: Optional[Dict[str, Optional[int]]] = None,
+                           earnings_format: str = "csv"):
+    """Insert rows skipping stored ones, or with from_years overwrite them.
+
+    from_years limits each symbol's rows to those from that year on (None for every year).
+    """
+    stock_table = sqlalchemy.Table(
+        "stockfinancialdata", sqlalchemy.MetaData(), autoload_with=session.bind
+    )
 
     if earnings_data_path:
-        df.to_csv(f"{earnings_data_path}/{symbol}.csv")
+        export_earnings(df, earnings_data_path, earnings_format)
 
-    # Save and insert data
-    data_to_insert = df.to_dict(orient='records')
+    if from_years is None:
+        insert_rows(session, stock_table, df.to_dict(orient='records'))
+    else:
+        df = df[df['year'] >= df['symbol'].map(lambda symbol: from_years.get(symbol) or 0)]
+        upsert_rows(session, stock_table, df.to_dict(orient='records'), FINANCIAL_DATA_KEY)
+    commit_progress(session)
 
-    if session.bind.dialect.name == "postgresql":
-        statement = (
-            insert_postgres(stock_table)
-            .values(data_to_insert)
-            .on_conflict_do_nothing()
-        )
-    elif session.bind.dialect.name == "sqlite":
-        statement = (
-            insert(stock_table).values(data_to_insert).prefix_with("OR IGNORE")
-        )
 
-    session.execute(statement)
-    session.commit()
+def load_stored_financial_rows(session: sqlalchemy.orm.Session, years: Dict[str, int]) -> pd.DataFrame:
+    """Stored rows of the given year per symbol."""
+    stock_table = sqlalchemy.Table(
+        "stockfinancialdata", sqlalchemy.MetaData(), autoload_with=session.bind
+    )
+    query = select(*(stock_table.c[column] for column in FINANCIAL_FRAME_COLUMNS)).where(
+        sqlalchemy.tuple_(stock_table.c.symbol, stock_table.c.year).in_(list(years.items()))
+    )
+    return pd.DataFrame(session.execute(query).fetchall(), columns=FINANCIAL_FRAME_COLUMNS)
+
+
+def add_stored_neighbors(session: sqlalchemy.orm.Session,
+                         df: pd.DataFrame,
+                         from_years: Dict[str, Optional[int]]) -> pd.DataFrame:
+    # The first recomputed year's YoY and QoQ are relative to the stored year before it
+    years = {symbol: from_year - 1 for symbol, from_year in from_years.items() if from_year is not None}
+    stored = load_stored_financial_rows(session, years) if years else None
+    if stored is None or stored.empty:
+        return df
+    return pd.concat([stored, df], ignore_index=True)
+
+
+def write_financial_frame(session: sqlalchemy.orm.Session,
+                          df: pd.DataFrame,
+                          earnings_data_path: Optional[str] = None,
+                          from_years: Optional[Dict[str, Optional[int]]] = None,
+                          earnings_format: str = "csv"):
+    """Add YoY and QoQ changes to estimated amounts and write them, see insert_financial_frame."""
+    if from_years and not earnings_data_path:
+        df = add_stored_neighbors(session, df, from_years)
+    insert_financial_frame(session, calculate_period_changes(df), earnings_data_path, from_years, earnings_format)
+
+
+def first_year_filed_since(records: List[Dict], filed_since: date) -> Optional[int]:
+    """Return the first year whose amounts facts filed since filed_since can change, None without any."""
+    filed_since = filed_since.isoformat()
+    years = [
+        int((record.get("start") or record["end"])[:4])
+        for record in records
+        if record.get("filed", "") >= filed_since
+    ]
+    return min(years) - ESTIMATE_LOOKAHEAD_YEARS if years else None
+
 
+def facts_include_latest_filing(job: Dict) -> bool:
+    """Whether company facts are up to date with the job's latest filing, whatever concepts it reported."""
+    latest_filing = job['latest_filing']
+    # Filings without XBRL never reach company facts
+    if not latest_filing.get("xbrl", True):
+        return True
+    return job.get("facts_filed") is not None and job['facts_filed'] >= latest_filing['filingdate'].isoformat()
 
-def fetch_and_insert_revenues_data(session: sqlalchemy.orm.Session, 
-                                   stocks: List[Dict[str, str]], 
-                                   earnings_data_path: Optional[str] = None,
-                                   facts_data_path: Optional[str] = None,
-                                   start_year: Optional[int] = None,
-                                   end_year: Optional[int] = None):
-    cik_file_path = Path(__file__).parent / "tickers_cik_info.json"
-    cik_info = load_cik_info(cik_file_path)
-    requests_session = create_session()
 
-    for stock in stocks:
-        symbol = stock['ticker']
-        sector = stock['sector']
-        cik = str(cik_info.get(symbol, {}).get("cik_str", "")).zfill(10)
-        logging.info(f"Processing {symbol} with CIK {cik}")
+def plan_revenue_jobs(stocks: List[Dict[str, str]]) -> List[Dict]:
+    cik_info = CikIndex().lookup_many(stock['ticker'] for stock in stocks)
+    return [
+        {
+            "symbol": stock['ticker'],
+            "sector": stock['sector'],
+            "cik": str(cik_info.get(stock['ticker'], {}).get("cik", "")).zfill(10),
+        }
+        for stock in stocks
+    ]
+
 
-        company_facts = get_company_facts(requests_session, cik)
+def filing_state_row(job: Dict) -> Dict:
+    return {
+        "cik": job['cik'],
+        "symbol": job['symbol'],
+        "accessionnumber": job['latest_filing']['accessionnumber'],
+        "filingdate": job['latest_filing']['filingdate'],
+    }
+
+
+def filing_state_rows(jobs: List[Dict]) -> List[Dict]:
+    # Filings not yet in company facts keep the recorded state, so they are fetched again
+    return [filing_state_row(job) for job in jobs if job.get("record_filing")]
+
+
+def plan_changed_revenue_jobs(session: sqlalchemy.orm.Session,
+                              jobs: List[Dict],
+                              requests_session: requests.Session,
+                              max_workers: Optional[int] = None) -> List[Dict]:
+    """Drop the jobs of companies without a periodic filing since they were last processed.
+
+    Kept jobs get filed_since, the filing date facts are new from (None to rewrite
+    every year), and latest_filing, recorded once the company is processed. Submissions
+    are a few hundred KB per company, against MBs of company facts.
+    """
+    state = load_filing_state(session)
+    with ThreadPoolExecutor(max_workers=max_workers or 1) as executor:
+        filings = list(executor.map(
+            lambda job: get_periodic_filings(requests_session, job['cik'], HEADERS), jobs
+        ))
+
+    changed_jobs = []
+    for job, job_filings in zip(jobs, filings):
+        if job_filings is None:
+            # Submissions unavailable, the company is processed as it always was
+            changed_jobs.append({**job, "filed_since": None})
+            continue
 
-        if not company_facts:
-            logging.warn(f"No company facts for {symbol}, skipping...")
+        filed, filed_since = changed_since(job_filings, state.get((job['cik'], job['symbol'])))
+        if not filed:
+            logging.info(f"Skipping {job['symbol']}, no new filings since the last run")
             continue
+        changed_job = {**job, "filed_since": filed_since}
+        if job_filings:
+            changed_job["latest_filing"] = job_filings[0]
+        changed_jobs.append(changed_job)
+
+    logging.info(f"{len(changed_jobs)} of {len(jobs)} companies filed since the last run")
+    return changed_jobs
+
+
+def transform_revenue_job(job: Dict,
+                          filtered_facts: Optional[List[Dict]],
+                          start_year: Optional[int] = None,
+                          end_year: Optional[int] = None,
+                          estimate_all_years: bool = False) -> Tuple[Dict, Optional[pd.DataFrame]]:
+    """Estimate one company's amounts, the CPU-bound stage that can run in a process pool.
+
+    Returns the job, with the from_year it was estimated from, and its amounts frame
+    (None when the company is skipped). Jobs planned by plan_changed_revenue_jobs only
+    estimate the years their facts filed since filed_since can change, unless
+    estimate_all_years is set. Their latest_filing is only recorded (record_filing set)
+    once company facts include it, and when it changed none of the mapped facts the job
+    comes back with filing_only set, nothing has to be rewritten.
+    """
+    symbol = job['symbol']
+    if not filtered_facts:
+        logging.info(f"Skipping {symbol} due to missing revenue data.")
+        return job, None
+
+    try:
+        from_year = None
+        if "latest_filing" in job:
+            # Facts of the recorded filing are dated filed_since too, so they alone give a from_year
+            job = {**job, "record_filing": facts_include_latest_filing(job)}
+        if job.get("filed_since") is not None:
+            from_year = first_year_filed_since(filtered_facts, job['filed_since'])
+            if from_year is None:
+                if job.get("record_filing"):
+                    # E.g. a 10-K/A only adding Part III, the filing is recorded without a rewrite
+                    logging.info(f"Skipping {symbol}, its new filings changed none of its amounts")
+                    return {**job, "filing_only": True}, None
+                # Left unrecorded, so the filing is picked up once company facts include it
+                logging.info(f"Skipping {symbol}, its new filings aren't in company facts yet")
+                return job, None
+
+        amounts = estimate_financial_amounts(
+            filtered_facts, start_year, end_year, None if estimate_all_years else from_year
+        )
+        return {**job, "from_year": from_year}, build_financial_frame(symbol, job['sector'], amounts)
+    except KeyError as e:
+        # Log the error with stack trace
+        logging.error(f"Key error: {e}\n{traceback.format_exc()}")
+        logging.info(f"Skipping {symbol} due to missing revenue data.")
+        return job, None
+
+
+def write_revenue_job(session: sqlalchemy.orm.Session,
+                      job: Dict,
+                      df: Optional[pd.DataFrame],
+                      earnings_data_path: Optional[str] = None,
+                      batch: Optional[List[Tuple[Dict, pd.DataFrame]]] = None,
+                      earnings_format: str = "csv"):
+    """Write one company's transformed amounts, or append them to batch when given."""
+    if df is None:
+        if job.get("filing_only"):
+            record_filing_state(session, filing_state_rows([job]))
+        return
+    if batch is not None:
+        batch.append((job, df))
+        return
+
+    from_years = {job['symbol']: job['from_year']} if "filed_since" in job else None
+    write_financial_frame(session, df, earnings_data_path, from_years, earnings_format)
+    record_filing_state(session, filing_state_rows([job]))
+
+
+def transform_archived_job(facts_data_path: str,
+                           job: Dict,
+                           start_year: Optional[int] = None,
+                           end_year: Optional[int] = None) -> Tuple[Dict, Optional[pd.DataFrame]]:
+    # Workers read the memory mapped archive themselves, so facts aren't pickled over
+    records = FactsArchive(facts_data_path).read(job['symbol'], columns=ESTIMATION_COLUMNS)
+    return transform_revenue_job(job, records, start_year, end_year, True)
+
+
+def process_revenue_job(session: sqlalchemy.orm.Session,
+                        job: Dict,
+                        filtered_facts: Optional[List[Dict]],
+                        earnings_data_path: Optional[str] = None,
+                        facts_data_path: Optional[str] = None,
+                        start_year: Optional[int] = None,
+                        end_year: Optional[int] = None,
+                        batch: Optional[List[Tuple[Dict, pd.DataFrame]]] = None,
+                        earnings_format: str = "csv"):
+    """Process one company's facts, appending its amounts to batch instead of inserting when given."""
+    if filtered_facts and facts_data_path:
+        save_facts_to_file(filtered_facts, job['symbol'], facts_data_path)
+    job, df = transform_revenue_job(job, filtered_facts, start_year, end_year, bool(earnings_data_path))
+    write_revenue_job(session, job, df, earnings_data_path, batch, earnings_format)
+
 
-        if "us-gaap" in company_facts["facts"]:
-            filtered_facts = filter_facts(company_facts)
-            if filtered_facts:
-                try:
-                    if facts_data_path:
-                        save_facts_to_file(filtered_facts, symbol, facts_data_path)
-
-                    process_and_insert_revenues_data_for_stock(session=session,
-                                                               records=filtered_facts,
-                                                               symbol=symbol, 
-                                                               sector=sector,
-                                                               earnings_data_path=earnings_data_path,
-                                                               start_year=start_year, 
-                                                               end_year=end_year)
-                except KeyError as e:
-                    # Log the error with stack trace
-                    logging.error(f"Key error: {e}\n{traceback.format_exc()}")
-                    logging.info(f"Skipping {symbol} due to missing revenue data.")
-            else:
-                logging.info(f"Skipping {symbol} due to missing revenue data.")
+def fetch_and_insert_revenues_data(session: sqlalchemy.orm.Session, 
+                                   stocks: List[Dict[str, str]], 
+                                   earnings_data_path: Optional[str] = None,
+                                   facts_data_path: Optional[str] = None,
+                                   start_year: Optional[int] = None,
+                                   end_year: Optional[int] = None,
+                                   cache: Optional[MarketDataCache] = None,
+                                   prefetched: Optional[Dict[str, Optional[List[Dict]]]] = None,
+                                   max_workers: Optional[int] = None,
+                                   companyfacts_zip_path: Optional[str] = None,
+                                   batch_insert: bool = False,
+                                   skip_unchanged: bool = False,
+                                   parallel_transform: bool = False,
+                                   earnings_format: str = "csv"):
+    """Fetch company facts for every stock and insert a row per CONCEPT_MAP report type and period.
+
+    Every report type is extracted from one parse of each company's facts.
+    Facts found in prefetched (keyed by symbol) are processed without downloading them again.
+    With max_workers > 1 downloads run in a thread pool sharing one pooled, rate-limited
+    session, and each company is processed on the calling thread as soon as it arrives.
+    With companyfacts_zip_path facts are read from SEC's bulk companyfacts.zip instead,
+    parsed in up to max_workers processes (all cores by default).
+    With batch_insert the estimated amounts of all companies are collected into one frame,
+    whose YoY and QoQ changes are computed in a single pass and inserted with one write.
+    With skip_unchanged companies without a new periodic filing since the last run (per
+    SEC submissions) aren't fetched at all. The others only estimate and rewrite the years
+    their newly filed facts can change, next to the stored rows of the year before (all
+    years are estimated when earnings CSVs are written). Replays process every company.
+    With parallel_transform the estimation runs in a process pool sized to the available
+    cores while downloads go on, and results are written by the calling thread only.
+    With earnings_format "parquet" the earnings under earnings_data_path go to one dataset
+    partitioned by sector and year (see EarningsDataset) instead of a CSV per symbol,
+    companies are then always batched so each partition is written once per run.
+    """
+    if earnings_format not in EARNINGS_FORMATS:
+        raise ValueError(f"Unknown earnings format {earnings_format}, expected one of {EARNINGS_FORMATS}")
+    requests_session = create_session(pool_maxsize=max(max_workers or 1, 10))
+
+    def fetch_revenue_job(job):
+        if prefetched is not None and job['symbol'] in prefetched:
+            return job, prefetched[job['symbol']]
+        records, facts_filed = get_company_records(requests_session, job['cik'], job['symbol'], cache)
+        return {**job, "facts_filed": facts_filed}, records
+
+    def write_transformed(wait: bool = False):
+        # In submission order, so a slow company holds back the writes queued after it
+        while transforms and (wait or transforms[0].done()):
+            write_revenue_job(session, *transforms.popleft().result(), earnings_data_path, batch, earnings_format)
+
+    def process(job, filtered_facts):
+        logging.info(f"Processing {job['symbol']} with CIK {job['cik']}")
+        if transform_pool is None:
+            process_revenue_job(session, job, filtered_facts, earnings_data_path, facts_data_path, start_year, end_year, batch, earnings_format)
+            return
+
+        if filtered_facts and facts_data_path:
+            save_facts_to_file(filtered_facts, job['symbol'], facts_data_path)
+        transforms.append(transform_pool.submit(
+            transform_revenue_job, job, filtered_facts, start_year, end_year, bool(earnings_data_path)
+        ))
+        write_transformed()
+
+    # A dataset write rewrites the partitions it touches, so every company goes in one write
+    batch = [] if batch_insert or (earnings_data_path and earnings_format == "parquet") else None
+    transforms = deque()
+    jobs = plan_revenue_jobs(stocks)
+    if skip_unchanged and not (cache and cache.replay):
+        jobs = plan_changed_revenue_jobs(session, jobs, requests_session, max_workers)
+
+    transform_executor = process_pool() if parallel_transform else nullcontext()
+    with transform_executor as transform_pool:
+        if companyfacts_zip_path and not (cache and cache.replay):
+            for job, filtered_facts in iter_revenue_records_from_archive(companyfacts_zip_path, jobs, max_workers):
+                if filtered_facts and cache:
+                    cache.store("sec", job['symbol'], "", "", pd.DataFrame(filtered_facts))
+                process(job, filtered_facts)
+        elif max_workers and max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(fetch_revenue_job, job) for job in jobs]
+                for future in as_completed(futures):
+                    process(*future.result())
         else:
-            logging.warn(f"No 'us-gaap' data in {symbol} facts, skipping...")
+            for job in jobs:
+                process(*fetch_revenue_job(job))
+        write_transformed(wait=True)
+
+    if batch:
+        df = pd.concat([frame for _, frame in batch], ignore_index=True)
+        from_years = {job['symbol']: job['from_year'] for job, _ in batch if "filed_since" in job}
+        logging.info(f"Inserting financial rows for {len(batch)} companies")
+        write_financial_frame(session, df, earnings_data_path, from_years or None, earnings_format)
+        record_filing_state(session, filing_state_rows([job for job, _ in batch]))
+
+
+def reprocess_facts_archive(session: sqlalchemy.orm.Session,
+                            stocks: List[Dict[str, str]],
+                            facts_data_path: str,
+                            earnings_data_path: Optional[str] = None,
+                            start_year: Optional[int] = None,
+                            end_year: Optional[int] = None,
+                            max_workers: Optional[int] = None,
+                            earnings_format: str = "csv"):
+    """Re-run the estimation over the facts archived in facts_data_path and overwrite the stored rows.
+
+    Nothing is downloaded, e.g. to apply a fix of the estimation to the whole universe.
+    With max_workers > 1 companies are transformed in that many processes.
+    """
+    if earnings_format not in EARNINGS_FORMATS:
+        raise ValueError(f"Unknown earnings format {earnings_format}, expected one of {EARNINGS_FORMATS}")
+    archive = FactsArchive(facts_data_path)
+    jobs = [{**job, "filed_since": None} for job in plan_revenue_jobs(stocks) if job['symbol'] in archive]
+    logging.info(f"Reprocessing archived facts of {len(jobs)} of {len(stocks)} companies")
+
+    if max_workers and max_workers > 1:
+        with process_pool(max_workers) as executor:
+            transformed = list(executor.map(
+                transform_archived_job,
+                [facts_data_path] * len(jobs),
+                jobs,
+                [start_year] * len(jobs),
+                [end_year] * len(jobs),
+                chunksize=max(1, len(jobs) // (4 * max_workers)),
+            ))
+    else:
+        transformed = [transform_archived_job(facts_data_path, job, start_year, end_year) for job in jobs]
+
+    batch = []
+    for job, df in transformed:
+        write_revenue_job(session, job, df, earnings_data_path, batch)
+    if batch:
+        df = pd.concat([frame for _, frame in batch], ignore_index=True)
+        write_financial_frame(session, df, earnings_data_path, {job['symbol']: None for job, _ in batch}, earnings_format)
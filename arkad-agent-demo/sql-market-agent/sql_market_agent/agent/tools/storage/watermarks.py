@@ -0,0 +1,54 @@
+import sqlalchemy
+import logging
+from datetime import datetime, date
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func
+
+
+def parse_date(value) -> Optional[date]:
+    # SQLite hands dates back as text, Postgres as date objects
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    return value
+
+
+class WatermarkSnapshot:
+    """Last stored date and value for every key of a table, read once per run."""
+
+    def __init__(self, watermarks: Dict[str, Tuple[date, float]]):
+        self.watermarks = watermarks
+
+    @classmethod
+    def load(
+        cls,
+        session: sqlalchemy.orm.Session,
+        table: sqlalchemy.Table,
+        key_column: str,
+        value_column: str,
+        keys: Optional[List[str]] = None,
+        before: Optional[str] = None,
+    ) -> "WatermarkSnapshot":
+        """Load the last row of every key, or of the given keys, optionally before a date."""
+        key = table.c[key_column]
+        latest = select(key.label("key"), func.max(table.c.date).label("date"))
+        if keys is not None:
+            latest = latest.where(key.in_(keys))
+        if before is not None:
+            latest = latest.where(table.c.date < before)
+        latest = latest.group_by(key).subquery()
+        query = select(key, table.c.date, table.c[value_column]).join(
+            latest, (key == latest.c.key) & (table.c.date == latest.c.date)
+        )
+
+        watermarks = {}
+        for row_key, row_date, row_value in session.execute(query):
+            watermarks[row_key] = (parse_date(row_date), row_value)
+
+        logging.info(f"Loaded watermarks for {len(watermarks)} keys from {table.name}")
+        return cls(watermarks)
+
+    def last_date(self, key: str) -> Optional[date]:
+        return self.watermarks.get(key, (None, None))[0]
+
+    def last_value(self, key: str) -> Optional[float]:
+        return self.watermarks.get(key, (None, None))[1]
@@ -0,0 +1,42 @@
+import pytest
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from sql_market_agent.agent.tools.storage.db_fetcher import initialize_database
+
+
+def create_session(engine: sqlalchemy.engine.Engine, db_type: str):
+    initialize_database(engine, db_type)
+    return sessionmaker(bind=engine)()
+
+
+@pytest.fixture
+def sqlite_session(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'market.db'}")
+    session = create_session(engine, "sqlite")
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def postgres_server(tmp_path_factory):
+    # A throwaway server from the pgserver wheel, the COPY paths only exist on Postgres
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop")
+    yield server
+    server.cleanup()
+
+
+@pytest.fixture
+def postgres_session(postgres_server):
+    engine = sqlalchemy.create_engine(postgres_server.get_uri())
+    session = create_session(engine, "postgres")
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def session(request):
+    return request.getfixturevalue(f"{request.param}_session")
+
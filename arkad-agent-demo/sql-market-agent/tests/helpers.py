@@ -0,0 +1,6 @@
+import sqlalchemy
+
+
+def fetch_rows(session, table: str, order_by: str):
+    query = sqlalchemy.text(f"SELECT * FROM {table} ORDER BY {order_by}")
+    return [dict(row) for row in session.execute(query).mappings()]
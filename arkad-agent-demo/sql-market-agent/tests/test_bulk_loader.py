@@ -0,0 +1,55 @@
+import sqlalchemy
+from sql_market_agent.agent.tools.storage.bulk_loader import insert_rows, upsert_rows
+from tests.helpers import fetch_rows
+
+FINANCIAL_DATA_KEY = ["symbol", "sector", "year", "reporttype", "period"]
+
+
+def financial_row(amount, **overrides):
+    return {
+        "symbol": "AAPL",
+        "sector": "",
+        "year": 2023,
+        "reporttype": "Revenue",
+        "period": "Q1",
+        "amount": amount,
+        "qoq": None,
+        "yoy": 5.0,
+        **overrides,
+    }
+
+
+def stock_financial_table(session):
+    return sqlalchemy.Table("stockfinancialdata", sqlalchemy.MetaData(), autoload_with=session.bind)
+
+
+def test_empty_string_is_not_null(session):
+    insert_rows(session, stock_financial_table(session), [financial_row(100.0)])
+    session.commit()
+
+    [row] = fetch_rows(session, "stockfinancialdata", "year")
+    assert row["sector"] == ""
+    assert row["qoq"] is None
+
+
+def test_insert_skips_stored_rows(session):
+    table = stock_financial_table(session)
+    insert_rows(session, table, [financial_row(100.0)])
+    insert_rows(session, table, [financial_row(120.0), financial_row(50.0, period="Q2")])
+    session.commit()
+
+    rows = fetch_rows(session, "stockfinancialdata", "period")
+    assert [(row["period"], row["amount"]) for row in rows] == [("Q1", 100.0), ("Q2", 50.0)]
+
+
+def test_upsert_overwrites_revised_values(session):
+    table = stock_financial_table(session)
+    insert_rows(session, table, [financial_row(100.0), financial_row(50.0, period="Q2")])
+    upsert_rows(session, table, [financial_row(120.0, qoq=1.5)], FINANCIAL_DATA_KEY)
+    session.commit()
+
+    rows = fetch_rows(session, "stockfinancialdata", "period")
+    assert [(row["period"], row["amount"], row["qoq"]) for row in rows] == [
+        ("Q1", 120.0, 1.5),
+        ("Q2", 50.0, None),
+    ]
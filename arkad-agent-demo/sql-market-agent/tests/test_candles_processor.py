@@ -0,0 +1,47 @@
+import time
+import pandas as pd
+import pytest
+from sql_market_agent.agent.tools.storage.stocks.candles import candles_processor
+from tests.helpers import fetch_rows
+
+TRADING_DAYS = pd.bdate_range("2024-01-02", "2024-01-12", tz="America/New_York")
+
+
+class FakeTicker:
+    def __init__(self, symbol, session=None):
+        self.symbol = symbol
+
+    def history(self, start=None, end=None, **kwargs):
+        # Enough for requests on other threads to interleave with this one
+        time.sleep(0.001)
+        close = [100.0 + i for i in range(len(TRADING_DAYS))]
+        return pd.DataFrame(
+            {
+                "Open": close,
+                "High": close,
+                "Low": close,
+                "Close": close,
+                "Volume": [289826 + i for i in range(len(TRADING_DAYS))],
+            },
+            index=pd.Index(TRADING_DAYS, name="Date"),
+        )
+
+
+@pytest.fixture(autouse=True)
+def fake_yfinance(monkeypatch):
+    monkeypatch.setattr(candles_processor.yf, "Ticker", FakeTicker)
+
+
+def test_concurrent_requests_insert_every_symbol(session):
+    stocks = [{"ticker": f"S{i:02d}", "sector": "Tech"} for i in range(40)]
+
+    candles_processor.fetch_and_insert_stocks_data(
+        session, stocks, "2024-01-02", "2024-01-13", max_workers=8
+    )
+    session.commit()
+
+    rows = fetch_rows(session, "stockdata", "symbol, date")
+    assert {row["symbol"] for row in rows} == {stock["ticker"] for stock in stocks}
+    # The first candle of a fresh symbol only seeds the daily change
+    assert len(rows) == 40 * 8
+    assert all(isinstance(row["volume"], int) for row in rows)
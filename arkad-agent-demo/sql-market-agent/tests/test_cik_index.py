@@ -0,0 +1,43 @@
+import json
+import sqlite3
+import pytest
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.cik_index import CikIndex
+
+SEED = {
+    "AAPL": {"cik_str": 320193, "title": "Apple Inc."},
+    "MSFT": {"cik_str": 789019, "title": "MICROSOFT CORP"},
+}
+
+
+@pytest.fixture
+def seed_path(tmp_path):
+    path = tmp_path / "tickers_cik_info.json"
+    path.write_text(json.dumps(SEED))
+    return path
+
+
+def test_index_is_created_at_configured_path(tmp_path, seed_path, monkeypatch):
+    monkeypatch.setenv("CIK_INDEX_PATH", str(tmp_path / "cache" / "cik.db"))
+
+    index = CikIndex(seed_path=seed_path)
+
+    assert index.lookup("AAPL") == {"ticker": "AAPL", "cik": 320193, "title": "Apple Inc."}
+    assert index.index_path == tmp_path / "cache" / "cik.db"
+    assert index.index_path.exists()
+
+
+def test_lookups_open_the_index_read_only(tmp_path, seed_path):
+    index = CikIndex(tmp_path / "cik.db", seed_path)
+
+    assert index.find_by_title("microsoft corp") == [{"ticker": "MSFT", "cik": 789019, "title": "MICROSOFT CORP"}]
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        index.connect().execute("DELETE FROM tickercik")
+
+
+def test_seed_is_applied_once(tmp_path, seed_path):
+    index = CikIndex(tmp_path / "cik.db", seed_path)
+
+    assert index.refresh({"AAPL": {"cik_str": 320193, "title": "Apple Inc."}}) == (0, 1)
+    assert index.refresh({}) == (0, 0)
+
+    assert index.lookup_many(["AAPL", "MSFT"]) == {"AAPL": {"ticker": "AAPL", "cik": 320193, "title": "Apple Inc."}}
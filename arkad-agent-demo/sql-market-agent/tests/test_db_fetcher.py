@@ -0,0 +1,20 @@
+import sqlalchemy
+from sql_market_agent.agent.tools.storage.db_fetcher import existing_bookkeeping_tables
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.filing_state import load_filing_state
+from sql_market_agent.agent.tools.storage.symbol_metadata import symbol_metadata_table
+
+
+def test_bookkeeping_tables_of_an_ingested_database(session):
+    load_filing_state(session)
+    session.commit()
+    symbol_metadata_table.create(session.bind, checkfirst=True)
+
+    assert existing_bookkeeping_tables(session.bind) == ["symbolmetadata", "secfilingstate"]
+
+
+def test_user_database_without_bookkeeping_tables(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'trades.db'}")
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("CREATE TABLE trades (symbol TEXT, price REAL)"))
+
+    assert existing_bookkeeping_tables(engine) == []
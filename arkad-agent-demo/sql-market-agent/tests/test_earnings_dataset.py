@@ -0,0 +1,79 @@
+import pandas as pd
+import pyarrow.dataset as ds
+from sql_market_agent.agent.tools.storage.stocks.sec_forms import xbrl_processor
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.earnings_dataset import EarningsDataset
+from tests.helpers import fetch_rows
+
+
+def earnings(symbol, sector, amount, years=(2022, 2023)):
+    return pd.DataFrame(
+        [
+            {
+                "symbol": symbol,
+                "sector": sector,
+                "year": year,
+                "reporttype": "Revenue",
+                "period": period,
+                "amount": amount,
+                "yoy": None,
+                "qoq": None,
+            }
+            for year in years
+            for period in ["Q1", "Q2", "Q3", "Q4", "FY"]
+        ]
+    )
+
+
+def test_rewrite_replaces_stored_rows_in_one_file_per_partition(tmp_path):
+    dataset = EarningsDataset(tmp_path)
+    dataset.write(pd.concat([earnings("AAPL", "Technology", 1.0), earnings("MSFT", "Technology", 2.0)]))
+
+    dataset.write(earnings("AAPL", "Technology", 3.0, years=[2023]))
+    dataset.write(earnings("AAPL", "Technology", 3.0, years=[2023]))
+
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.rglob("*.parquet")) == [
+        "sector=Technology/year=2022/part-0.parquet",
+        "sector=Technology/year=2023/part-0.parquet",
+    ]
+    rows = dataset.read(columns=["symbol", "year", "amount"])
+    assert len(rows) == 20
+    assert rows.groupby(["symbol", "year"])["amount"].max().to_dict() == {
+        ("AAPL", 2022): 1.0,
+        ("AAPL", 2023): 3.0,
+        ("MSFT", 2022): 2.0,
+        ("MSFT", 2023): 2.0,
+    }
+
+
+def test_run_writes_each_partition_once(sqlite_session, tmp_path, monkeypatch):
+    writes = []
+    write = EarningsDataset.write
+    monkeypatch.setattr(EarningsDataset, "write", lambda self, df: writes.append(len(df)) or write(self, df))
+    monkeypatch.setattr(
+        xbrl_processor, "plan_revenue_jobs",
+        lambda stocks: [{"symbol": stock["ticker"], "sector": stock["sector"], "cik": ""} for stock in stocks],
+    )
+    facts = [
+        {"reporttype": "Revenue", "concept": "Revenues", "val": 100.0, "start": "2023-01-01", "end": "2023-12-31",
+         "fp": "FY", "filed": "2024-02-01", "frame": "CY2023"},
+    ]
+
+    xbrl_processor.fetch_and_insert_revenues_data(
+        sqlite_session,
+        [{"ticker": "AAPL", "sector": "Technology"}, {"ticker": "MSFT", "sector": "Technology"}],
+        str(tmp_path), start_year=2023, end_year=2024,
+        prefetched={"AAPL": facts, "MSFT": facts}, earnings_format="parquet",
+    )
+
+    assert writes == [10]
+    assert len(fetch_rows(sqlite_session, "stockfinancialdata", "symbol, period")) == 10
+
+
+def test_read_prunes_partitions(tmp_path):
+    dataset = EarningsDataset(tmp_path)
+    dataset.write(pd.concat([earnings("AAPL", "Technology", 1.0), earnings("XYZ", None, 2.0)]))
+
+    rows = dataset.read((ds.field("sector") == "Technology") & (ds.field("year") >= 2023), ["symbol", "period"])
+    assert rows["symbol"].unique().tolist() == ["AAPL"]
+    assert rows["period"].tolist() == ["Q1", "Q2", "Q3", "Q4", "FY"]
+    assert dataset.read(ds.field("sector").is_null(), ["symbol"])["symbol"].unique().tolist() == ["XYZ"]
@@ -0,0 +1,80 @@
+import pandas as pd
+import sqlalchemy
+from sql_market_agent.agent.tools.storage.fred import fred_processor
+from sql_market_agent.agent.tools.storage.market_data_cache import MarketDataCache
+from tests.helpers import fetch_rows
+
+# Not in the release catalog, so it is fetched on every run
+MACRO_METRICS = [{"symbol": "TESTRATE", "description": "Test rate"}]
+
+
+def observations(revised=None):
+    dates = pd.bdate_range(end=pd.Timestamp.now().normalize() - pd.Timedelta(days=3), periods=20)
+    values = pd.Series([4.0 + i / 100 for i in range(len(dates))], index=dates)
+    for day, value in (revised or {}).items():
+        values[day] = value
+    return {"TESTRATE": pd.DataFrame({"TESTRATE": values}).rename_axis("DATE")}
+
+
+def stored_rows(session):
+    return [
+        {key: row[key] for key in ["date", "macrometricvalue", "periodicchangepercent"]}
+        for row in fetch_rows(session, "macrometricdata", "date")
+    ]
+
+
+def test_revision_rewrites_only_the_revised_rows(session, monkeypatch):
+    fred_processor.fetch_and_insert_macro_metrics_data(session, MACRO_METRICS, prefetched=observations())
+    session.commit()
+    revised_day = observations()["TESTRATE"].index[10]
+    written = []
+    upsert_rows = fred_processor.upsert_rows
+    monkeypatch.setattr(
+        fred_processor,
+        "upsert_rows",
+        lambda session, table, rows, key: written.extend(rows) or upsert_rows(session, table, rows, key),
+    )
+
+    fred_processor.fetch_and_insert_macro_metrics_data(
+        session, MACRO_METRICS, prefetched=observations({revised_day: 4.5})
+    )
+    session.commit()
+    revised = stored_rows(session)
+
+    # The revised observation and the change of the one after it
+    assert [str(row["date"])[:10] for row in written] == [
+        revised_day.strftime("%Y-%m-%d"),
+        observations()["TESTRATE"].index[11].strftime("%Y-%m-%d"),
+    ]
+    session.execute(sqlalchemy.text("DELETE FROM macrometricdata"))
+    fred_processor.fetch_and_insert_macro_metrics_data(
+        session, MACRO_METRICS, prefetched=observations({revised_day: 4.5})
+    )
+    session.commit()
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(revised), pd.DataFrame(stored_rows(session)), check_exact=False, rtol=1e-5
+    )
+
+
+def fred_upstream(symbols, start, end, requests_session=None):
+    # Like FRED, the observation dated end is part of the response
+    dates = pd.bdate_range(start, end)
+    return {
+        symbol: pd.DataFrame({symbol: 1.0 + dates.dayofyear / 100}, index=dates).rename_axis("DATE")
+        for symbol in symbols
+    }
+
+
+def test_replay_serves_the_same_observations_as_a_live_fetch(tmp_path, monkeypatch):
+    monkeypatch.setattr(fred_processor, "fetch_fred_data_batch", fred_upstream)
+    job = {"symbol": "TESTRATE", "description": "Test rate"}
+    fred_processor.fetch_macro_metric_group(
+        [{**job, "start": "2024-01-01", "end": "2024-03-29"}], MarketDataCache(tmp_path)
+    )
+
+    # Not the cached window, so the replay slices the cached observations
+    window = {**job, "start": "2024-02-01", "end": "2024-03-29"}
+    replayed = fred_processor.fetch_macro_metric_group([window], MarketDataCache(tmp_path, replay=True))
+    live = fred_processor.fetch_macro_metric_group([window])
+
+    pd.testing.assert_frame_equal(replayed["TESTRATE"], live["TESTRATE"], check_freq=False)
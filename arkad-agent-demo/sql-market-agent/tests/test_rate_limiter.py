@@ -0,0 +1,51 @@
+from sql_market_agent.agent.tools.storage import db_fetcher, rate_limiter
+from sql_market_agent.agent.tools.storage.rate_limiter import RATE_LIMITER, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # A real sleep always lets some time pass
+        self.now += max(seconds, 1e-6)
+
+
+def test_reset_restores_retry_budget_and_clears_stats():
+    limiter = RateLimiter(retry_budget=2)
+    limiter.acquire("data.sec.gov")
+    assert limiter.take_retry("data.sec.gov")
+    assert limiter.take_retry("data.sec.gov")
+    assert not limiter.take_retry("data.sec.gov")
+
+    limiter.reset()
+
+    assert limiter.take_retry("data.sec.gov")
+    assert limiter.stats["data.sec.gov"] == {"requests": 0, "throttled": 1, "retries": 1, "wait_seconds": 0.0}
+
+
+def test_each_fetch_job_gets_a_fresh_retry_budget(tmp_path):
+    RATE_LIMITER.retry_budget = 0
+    RATE_LIMITER.acquire("fred.stlouisfed.org")
+
+    db_fetcher.run_fetch_job(f"sqlite:///{tmp_path / 'market.db'}")
+
+    assert RATE_LIMITER.retry_budget == RATE_LIMITER.initial_retry_budget
+    assert "fred.stlouisfed.org" not in RATE_LIMITER.stats
+
+
+def test_sec_requests_never_exceed_the_limit_in_any_second(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    limiter = RateLimiter()
+
+    sent = []
+    for _ in range(35):
+        limiter.acquire("data.sec.gov")
+        sent.append(clock.now)
+
+    busiest = max(sum(start <= at < start + 1 for at in sent) for start in sent)
+    assert busiest <= rate_limiter.HOST_RATE_LIMITS["data.sec.gov"]
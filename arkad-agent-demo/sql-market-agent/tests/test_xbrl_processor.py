@@ -0,0 +1,326 @@
+import io
+import json
+import random
+import threading
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pandas as pd
+import pytest
+import requests
+import sqlalchemy
+from sql_market_agent.agent.tools.storage.stocks.sec_forms import xbrl_processor
+from sql_market_agent.agent.tools.storage.stocks.sec_forms.filing_state import load_filing_state
+from tests.helpers import fetch_rows
+
+
+def fact(reporttype, concept, val, start, end, fp, filed="2024-02-01", frame=None):
+    record = {
+        "reporttype": reporttype,
+        "concept": concept,
+        "val": val,
+        "start": start,
+        "end": end,
+        "fp": fp,
+        "filed": filed,
+    }
+    if frame:
+        record["frame"] = frame
+    return record
+
+
+def company_facts(seed, years=range(2010, 2024)):
+    # Quarters, year to date totals and fiscal years, each reported with some gaps
+    rng = random.Random(seed)
+    records = []
+    for year in years:
+        quarters = [rng.randint(80, 120) * 1e6 for _ in range(4)]
+        for q in range(4):
+            filed = f"{year}-{3 * q + 5:02d}-10" if q < 3 else f"{year + 1}-02-10"
+            if rng.random() < 0.7:
+                records.append(fact("Revenue", "Revenues", quarters[q], f"{year}-{3 * q + 1:02d}-01",
+                                    f"{year}-{3 * q + 3:02d}-28", f"Q{q + 1}", filed=filed,
+                                    frame=f"CY{year}Q{q + 1}"))
+            if 0 < q < 3 and rng.random() < 0.7:
+                records.append(fact("Revenue", "Revenues", sum(quarters[:q + 1]), f"{year}-01-01",
+                                    f"{year}-{3 * q + 3:02d}-28", f"Q{q + 1}", filed=filed))
+                if rng.random() < 0.5:
+                    # Restated as the comparative of the next year's filing
+                    restated = {"val": records[-1]["val"] * 1.02, "filed": f"{year + 1}-{filed[5:]}"}
+                    records.append({**records[-1], **restated})
+        if rng.random() < 0.8:
+            records.append(fact("Revenue", "Revenues", sum(quarters), f"{year}-01-01", f"{year}-12-31", "FY",
+                                filed=f"{year + 1}-02-10", frame=f"CY{year}" if rng.random() < 0.7 else None))
+    return records
+
+
+class LinearRecords:
+    """The lookups RecordIndex replaced, scanning every record on each call."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def find_record_by_fp(self, year, fp):
+        for record in self.records:
+            if record['fp'] == fp and 'frame' not in record:
+                start_date = datetime.strptime(record["start"], "%Y-%m-%d")
+                end_date = datetime.strptime(record["end"], "%Y-%m-%d")
+                if end_date.year == year and xbrl_processor.months_diff(start_date, end_date) > 5:
+                    return record
+        return None
+
+    def calculate_historical_proportions(self, year, quarter):
+        historical_totals = {q: [] for q in ['Q1', 'Q2', 'Q3', 'Q4']}
+        for record in self.records:
+            if 'frame' in record and record['frame'].startswith(f'CY{year - 1}') and 'Q' in record['frame']:
+                historical_totals[record['frame'][-2:]].append(record['val'])
+
+        avg_proportions = {q: sum(vals) / len(vals) if vals else 0 for q, vals in historical_totals.items()}
+        total_avg = sum(avg_proportions.values())
+        return avg_proportions[quarter] / total_avg if total_avg else 0
+
+
+def loss_making_facts(reporttype, concept):
+    # Q2 is only implied by the nine months to Q3 minus Q3 itself
+    return [
+        fact(reporttype, concept, -5, "2023-01-01", "2023-03-31", "Q1", frame="CY2023Q1"),
+        fact(reporttype, concept, -10, "2023-07-01", "2023-09-30", "Q3", frame="CY2023Q3"),
+        fact(reporttype, concept, -30, "2023-01-01", "2023-09-30", "Q3"),
+    ]
+
+
+def test_signed_concepts_keep_negative_estimated_quarters():
+    amounts = xbrl_processor.estimate_financial_amounts(
+        loss_making_facts("NetIncome", "NetIncomeLoss"), 2023, 2024
+    )
+
+    assert amounts["NetIncome"]["CY2023Q2"] == -20
+    assert amounts["NetIncome"]["CY2023"] == sum(amounts["NetIncome"][f"CY2023Q{q}"] for q in range(1, 5))
+
+
+def test_unsigned_concepts_floor_estimated_quarters():
+    amounts = xbrl_processor.estimate_financial_amounts(loss_making_facts("Revenue", "Revenues"), 2023, 2024)
+
+    assert amounts["Revenue"]["CY2023Q2"] == 0
+
+
+def test_first_listed_concept_wins_over_larger_alias():
+    records = [
+        fact("NetIncome", "ProfitLoss", 120, "2023-01-01", "2023-12-31", "FY", frame="CY2023"),
+        fact("NetIncome", "NetIncomeLoss", 100, "2023-01-01", "2023-12-31", "FY", frame="CY2023"),
+        fact("EPS", "EarningsPerShareBasic", 1.1, "2023-01-01", "2023-12-31", "FY", frame="CY2023"),
+        fact("EPS", "EarningsPerShareDiluted", 1.0, "2023-01-01", "2023-12-31", "FY", frame="CY2023"),
+    ]
+
+    amounts = xbrl_processor.estimate_financial_amounts(records, 2023, 2024)
+
+    assert amounts["NetIncome"]["CY2023"] == 100
+    assert amounts["EPS"] == {"CY2023": 1.0}
+
+
+def test_latest_filing_wins_within_a_concept():
+    records = [
+        fact("NetIncome", "NetIncomeLoss", 80, "2022-01-01", "2022-12-31", "FY",
+             filed="2024-02-01", frame="CY2022"),
+        fact("NetIncome", "NetIncomeLoss", 90, "2022-01-01", "2022-12-31", "FY",
+             filed="2023-02-01", frame="CY2022"),
+    ]
+
+    amounts = xbrl_processor.estimate_financial_amounts(records, 2022, 2023)
+
+    assert amounts["NetIncome"]["CY2022"] == 80
+
+
+def period_rows(amounts):
+    return pd.DataFrame(
+        [
+            {"symbol": "AAPL", "sector": "Technology", "year": year, "reporttype": "EPS", "period": period,
+             "amount": amount}
+            for (year, period), amount in amounts.items()
+        ]
+    )
+
+
+def changes(df):
+    return {
+        (row["year"], row["period"]): (row["yoy"], row["qoq"])
+        for row in xbrl_processor.calculate_period_changes(df).replace({float("nan"): None}).to_dict("records")
+    }
+
+
+def test_quarter_after_a_missing_q4_has_no_qoq():
+    # Like EPS, the fourth quarter is only reported within the fiscal year
+    df = period_rows({
+        (2023, "Q1"): 1.0, (2023, "Q2"): 1.5, (2023, "Q3"): 2.0, (2023, "FY"): 6.0, (2024, "Q1"): 2.0,
+    })
+
+    result = changes(df)
+
+    assert result[(2023, "Q2")] == (None, 50.0)
+    assert result[(2023, "FY")] == (None, None)
+    assert result[(2024, "Q1")] == (100.0, None)
+
+
+def test_year_after_a_missing_year_has_no_yoy():
+    df = period_rows({
+        (2021, "Q4"): 1.0, (2021, "FY"): 4.0, (2023, "Q1"): 2.0, (2023, "FY"): 8.0, (2024, "FY"): 10.0,
+    })
+
+    result = changes(df)
+
+    assert result[(2023, "Q1")] == (None, None)
+    assert result[(2023, "FY")] == (None, None)
+    assert result[(2024, "FY")] == (25.0, None)
+
+
+def filed_job(facts_filed, xbrl=True):
+    return {
+        "symbol": "AAPL",
+        "sector": "Technology",
+        "cik": "0000320193",
+        "filed_since": date(2024, 5, 3),
+        "latest_filing": {
+            "accessionnumber": "0000320193-24-000081",
+            "filingdate": date(2024, 6, 7),
+            "reportdate": date(2023, 9, 30),
+            "xbrl": xbrl,
+        },
+        "facts_filed": facts_filed,
+    }
+
+
+def test_company_facts_report_latest_filing_of_any_concept():
+    document = {
+        "facts": {
+            "us-gaap": {
+                "Revenues": {"units": {"USD": [
+                    fact("Revenue", "Revenues", 100, "2023-01-01", "2023-12-31", "FY", filed="2024-02-01"),
+                ]}},
+                "StockIssuedDuringPeriodValueNewIssues": {"units": {"USD": [
+                    fact("Equity", "StockIssuedDuringPeriodValueNewIssues", 5, "2024-01-01", "2024-03-31", "Q1",
+                         filed="2024-05-03"),
+                ]}},
+            },
+        },
+    }
+
+    company_facts = xbrl_processor.extract_company_facts(io.BytesIO(json.dumps(document).encode()))
+
+    assert company_facts["filed"] == "2024-05-03"
+    assert list(company_facts["facts"]["us-gaap"]) == ["Revenues"]
+
+
+class TruncatedFactsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({"facts": {"us-gaap": {"Revenues": {"units": {"USD": [{"val": 1}] * 100}}}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # The connection drops halfway through the body
+        self.wfile.write(body[:len(body) // 2])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def truncating_server(monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), TruncatedFactsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(xbrl_processor, "COMPANY_FACTS_URL", f"http://127.0.0.1:{server.server_port}/CIK{{}}.json")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_stream_cut_mid_body_skips_the_company(truncating_server, caplog):
+    assert xbrl_processor.get_company_facts(requests.Session(), "0000320193") is None
+    assert "0000320193" in caplog.text
+
+
+@pytest.mark.parametrize("facts_filed, xbrl", [("2024-06-07", True), (None, False)])
+def test_filing_without_mapped_facts_is_recorded(sqlite_session, facts_filed, xbrl):
+    # Planning the jobs creates the state table
+    load_filing_state(sqlite_session)
+    records = [fact("Revenue", "Revenues", 100, "2023-01-01", "2023-12-31", "FY", frame="CY2023")]
+
+    job, df = xbrl_processor.transform_revenue_job(filed_job(facts_filed, xbrl), records, 2023, 2024)
+    xbrl_processor.write_revenue_job(sqlite_session, job, df)
+
+    assert df is None
+    state = load_filing_state(sqlite_session)
+    assert state[("0000320193", "AAPL")]["accessionnumber"] == "0000320193-24-000081"
+    assert fetch_rows(sqlite_session, "stockfinancialdata", "year") == []
+
+
+def test_filing_missing_from_company_facts_is_not_recorded(sqlite_session):
+    # Planning the jobs creates the state table
+    load_filing_state(sqlite_session)
+    records = [fact("Revenue", "Revenues", 100, "2023-01-01", "2023-12-31", "FY", frame="CY2023")]
+
+    job, df = xbrl_processor.transform_revenue_job(filed_job("2024-05-03"), records, 2023, 2024)
+    xbrl_processor.write_revenue_job(sqlite_session, job, df)
+
+    assert df is None
+    assert load_filing_state(sqlite_session) == {}
+
+
+@pytest.mark.parametrize("batch_insert", [False, True])
+def test_filing_is_not_recorded_before_company_facts_include_it(sqlite_session, monkeypatch, batch_insert):
+    load_filing_state(sqlite_session)
+    # Facts of the recorded filing are dated filed_since, the newest filing isn't in company facts yet
+    records = [fact("Revenue", "Revenues", 100, "2023-01-01", "2023-12-31", "FY", filed="2024-05-03", frame="CY2023")]
+    job = filed_job("2024-05-03")
+    monkeypatch.setattr(xbrl_processor, "plan_revenue_jobs", lambda stocks: [job])
+    monkeypatch.setattr(xbrl_processor, "plan_changed_revenue_jobs", lambda session, jobs, *args: jobs)
+    monkeypatch.setattr(
+        xbrl_processor, "get_company_records", lambda session, cik, symbol, cache: (records, job["facts_filed"])
+    )
+
+    xbrl_processor.fetch_and_insert_revenues_data(
+        sqlite_session, [{"ticker": "AAPL", "sector": "Technology"}], start_year=2023, end_year=2024,
+        batch_insert=batch_insert, skip_unchanged=True,
+    )
+
+    assert [row["year"] for row in fetch_rows(sqlite_session, "stockfinancialdata", "period")] == [2023] * 5
+    assert load_filing_state(sqlite_session) == {}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_record_index_estimates_like_linear_scans(monkeypatch, seed):
+    records = company_facts(seed)
+    indexed = xbrl_processor.estimate_financial_amounts(records, 2010, 2024)
+
+    monkeypatch.setattr(xbrl_processor, "RecordIndex", LinearRecords)
+
+    assert xbrl_processor.estimate_financial_amounts(records, 2010, 2024) == indexed
+
+
+def write_jobs(session, facts, filed_since=None):
+    for symbol, records in facts.items():
+        job = {"symbol": symbol, "sector": "Technology", "cik": "", "filed_since": filed_since}
+        xbrl_processor.write_revenue_job(session, *xbrl_processor.transform_revenue_job(job, records, 2010, 2024))
+    session.commit()
+
+
+def test_incremental_run_matches_full_rebuild(session):
+    facts = {f"S{seed}": company_facts(seed) for seed in range(3)}
+    # Nothing reported for 2021, its quarters are estimated from the 2022 fiscal year once it's filed
+    facts["S0"] = [
+        record for record in facts["S0"]
+        if "2021" not in record["end"] and record.get("frame") != "CY2020"
+        and not (record["fp"] == "FY" and record["end"].startswith("2022"))
+    ] + [fact("Revenue", "Revenues", 400e6, "2022-01-01", "2022-12-31", "FY", filed="2023-02-10", frame="CY2022")]
+    filed_since = date(2023, 1, 1)
+    write_jobs(session, {
+        symbol: [record for record in records if record["filed"] < filed_since.isoformat()]
+        for symbol, records in facts.items()
+    })
+
+    write_jobs(session, facts, filed_since)
+    incremental = pd.DataFrame(fetch_rows(session, "stockfinancialdata", "symbol, year, reporttype, period"))
+    session.execute(sqlalchemy.text("DELETE FROM stockfinancialdata"))
+    write_jobs(session, facts)
+    full = pd.DataFrame(fetch_rows(session, "stockfinancialdata", "symbol, year, reporttype, period"))
+
+    assert incremental["year"].min() == 2010
+    pd.testing.assert_frame_equal(incremental.drop(columns="id"), full.drop(columns="id"), check_exact=False)
@@ -1,10 +1,13 @@
 from pathlib import Path
 import json
+import os
 from typing import List, Dict
 import pandas as pd
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
 import yfinance as yf
+import sqlalchemy
 import logging
+from pandas_market_agent.agent.tools.storage.symbol_metadata import resolve_industries
 
 # Setup basic logging
 logging.basicConfig(
@@ -18,6 +21,17 @@ def read_stocks_from_json(file_path: str) -> json:
         return json.load(file)
 
 
+# Written at runtime, so it lives outside the package directory, next to the CIK index.
+# The SYMBOL_METADATA_PATH environment variable points it elsewhere.
+DEFAULT_SYMBOL_METADATA_PATH = Path.home() / ".cache" / "sql_market_agent" / "symbol_metadata.db"
+
+
+def get_metadata_engine() -> sqlalchemy.engine.Engine:
+    metadata_path = Path(os.environ.get("SYMBOL_METADATA_PATH") or DEFAULT_SYMBOL_METADATA_PATH)
+    metadata_path.parent.mkdir(parents=True, exist_ok=True)
+    return sqlalchemy.create_engine(f"sqlite:///{metadata_path}")
+
+
 def run_fetch_job(stocks: List[Dict[str, str]] = None) -> List:
     if not stocks:
         logging.info(
@@ -28,13 +42,14 @@ def run_fetch_job(stocks: List[Dict[str, str]] = None) -> List:
 
     sector_dataframes = {}
 
+    # Sectors that are not provided come from the persistent metadata cache
+    industries = resolve_industries(
+        get_metadata_engine(), [stock["ticker"] for stock in stocks if not stock["sector"]]
+    )
+
     for stock in stocks:
         ticker = stock["ticker"]
-        sector = stock["sector"]
-
-        # Fetching sector from yfinance if it's not provided
-        if not sector:
-            sector = yf.Ticker(ticker).get_info().get("industry", "Other")
+        sector = stock["sector"] or industries.get(ticker, "Other")
 
         # Fetching OHLC data for the stock
         data = yf.Ticker(ticker).history(period="1mo")
@@ -0,0 +1,131 @@
+import yfinance as yf
+import requests
+import sqlalchemy
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+from sqlalchemy import Table, Column, MetaData, Text, DateTime, select
+from sqlalchemy.dialects.postgresql import insert as insert_postgres
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+
+METADATA_TTL_DAYS = 30
+METADATA_REFRESH_WORKERS = 8
+
+symbol_metadata_table = Table(
+    "symbolmetadata",
+    MetaData(),
+    Column("symbol", Text, primary_key=True),
+    Column("sector", Text),
+    Column("industry", Text),
+    Column("name", Text),
+    Column("updatedat", DateTime, nullable=False),
+)
+
+
+def fetch_symbol_metadata(
+    symbol: str, requests_session: Optional[requests.Session] = None
+) -> Optional[Dict]:
+    try:
+        info = yf.Ticker(symbol, session=requests_session).get_info()
+    except Exception as e:
+        logging.error(f"Error fetching metadata for {symbol}: {e}")
+        return None
+
+    return {
+        "symbol": symbol,
+        "sector": info.get("sector"),
+        "industry": info.get("industry"),
+        "name": info.get("shortName"),
+        "updatedat": datetime.now(),
+    }
+
+
+def upsert_symbol_metadata(engine: sqlalchemy.engine.Engine, rows: List[Dict]):
+    if engine.dialect.name == "postgresql":
+        statement = insert_postgres(symbol_metadata_table)
+    elif engine.dialect.name == "sqlite":
+        statement = insert_sqlite(symbol_metadata_table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["symbol"],
+        set_={
+            column: statement.excluded[column]
+            for column in ["sector", "industry", "name", "updatedat"]
+        },
+    )
+    with engine.begin() as conn:
+        conn.execute(statement, rows)
+
+
+def refresh_symbol_metadata(
+    engine: sqlalchemy.engine.Engine,
+    symbols: List[str],
+    max_workers: int = METADATA_REFRESH_WORKERS,
+    requests_session: Optional[requests.Session] = None,
+) -> Dict[str, Dict]:
+    """Fetch metadata for symbols from yfinance and store it in one statement."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = [
+            row
+            for row in executor.map(
+                lambda symbol: fetch_symbol_metadata(symbol, requests_session), symbols
+            )
+            if row
+        ]
+
+    if rows:
+        upsert_symbol_metadata(engine, rows)
+    logging.info(f"Refreshed metadata for {len(rows)} of {len(symbols)} symbols")
+    return {row["symbol"]: row for row in rows}
+
+
+def get_symbol_metadata(
+    engine: sqlalchemy.engine.Engine,
+    symbols: List[str],
+    ttl_days: int = METADATA_TTL_DAYS,
+    refresh: bool = True,
+    requests_session: Optional[requests.Session] = None,
+) -> Dict[str, Dict]:
+    """Return cached metadata for symbols, refreshing missing and expired entries.
+
+    With refresh=False only what is already cached is returned, expired or not.
+    """
+    symbol_metadata_table.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        cached = {
+            row["symbol"]: dict(row)
+            for row in conn.execute(
+                select(symbol_metadata_table).where(
+                    symbol_metadata_table.c.symbol.in_(symbols)
+                )
+            ).mappings()
+        }
+
+    expires = datetime.now() - timedelta(days=ttl_days)
+    stale = [
+        symbol
+        for symbol in symbols
+        if symbol not in cached or cached[symbol]["updatedat"] < expires
+    ]
+    if stale and refresh:
+        cached.update(
+            refresh_symbol_metadata(engine, stale, requests_session=requests_session)
+        )
+    return cached
+
+
+def resolve_industries(
+    engine: sqlalchemy.engine.Engine,
+    symbols: List[str],
+    ttl_days: int = METADATA_TTL_DAYS,
+    refresh: bool = True,
+    requests_session: Optional[requests.Session] = None,
+) -> Dict[str, str]:
+    if not symbols:
+        return {}
+    metadata = get_symbol_metadata(engine, symbols, ttl_days, refresh, requests_session)
+    return {
+        symbol: metadata[symbol]["industry"]
+        for symbol in symbols
+        if symbol in metadata and metadata[symbol]["industry"]
+    }